@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import PersonalityQuiz, AttractionQuiz
+from .models import PersonalityQuiz, AttractionQuiz, Event, MatchGeneration, MatchResult, CheckIn
 
 admin.site.register(PersonalityQuiz)
-admin.site.register(AttractionQuiz)
\ No newline at end of file
+admin.site.register(AttractionQuiz)
+admin.site.register(Event, raw_id_fields=['attendees'])  # A select box of every user doesn't scale
+admin.site.register(MatchGeneration)
+admin.site.register(MatchResult)
+admin.site.register(CheckIn)
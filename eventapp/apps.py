@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EventappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'eventapp'
+
+    def ready(self):
+        # eventapp is the last installed app, so every model is loaded by now
+        from matchsite import startup
+        startup.mark('apps')
+        if settings.STARTUP_REPORT:
+            startup.report()
@@ -0,0 +1,324 @@
+"""
+One-to-one pairing that maximizes the total match score.
+
+Only pairs that appear in somebody's top-k are considered, which keeps the
+problem sparse. The pairing is solved as an assignment problem on the
+"double cover" of that graph (every user appears once as a bidder and once as
+a seat, and sitting in your own seat means staying unpaired) with a
+vectorized auction algorithm. Because scores are symmetric, mutual choices in
+the optimal assignment are pairs, and even cycles split into two halves of
+equal value. Odd cycles can't be split into pairs; each is split directly,
+leaving one of its users out, and short augmenting paths then win back what
+that cost. (Re-auctioning with odd-cycle edges cut doesn't converge on the
+tie-heavy scores Likert answers produce.) Half the assignment's value bounds
+the best pairing within the candidate graph, so the remaining optimality gap
+is reported alongside the result. Users the paths can't place are finally
+paired among themselves by their direct scores. The whole solve stops
+refining once `time_limit` runs out.
+"""
+import time
+
+import numpy as np
+
+from .matching import Population, personality_scores, top_k
+
+# Auction stops once prices are within this much of optimal per seat, so the
+# assignment is within n * FINAL_EPSILON of the best possible total
+FINAL_EPSILON = 1e-6
+
+# How much epsilon shrinks between auction phases
+EPSILON_FACTOR = 4.0
+
+# Longest augmenting path (in new pairs) tried when repairing odd cycles
+AUGMENT_DEPTH = 4
+
+# Seconds the solver may spend after top-k; past it the auction keeps its last
+# finished phase and the repair stops searching
+TIME_LIMIT = 30.0
+
+
+class Pairing:
+    """
+    Result of pair_up: population positions paired together, plus bookkeeping.
+    `leftover_score` is what pairs outside the candidate graph add; the upper
+    bound doesn't cover them.
+    """
+
+    def __init__(self, pairs, scores, upper_bound, leftover_score=0.0):
+        self.pairs = pairs
+        self.scores = scores
+        self.objective = float(np.sum(scores))
+        self.leftover_score = float(leftover_score)
+        self.upper_bound = max(float(upper_bound), self.candidate_objective)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    @property
+    def candidate_objective(self):
+        """Total score of the pairs inside the candidate graph."""
+        return self.objective - self.leftover_score
+
+    @property
+    def gap(self):
+        """How far those pairs could at most be from the best pairing within the candidate graph."""
+        return self.upper_bound - self.candidate_objective
+
+
+def candidate_graph(indices, scores):
+    """
+    Symmetric candidate graph from per-user top-k lists, padded to equal width.
+
+    Returns (neighbours, weights), both shaped (n, width). Column 0 is always
+    the user themselves with weight 0 (staying unpaired); unused slots hold
+    the user's own index with weight -inf.
+    """
+    n, k = indices.shape
+    sources = np.repeat(np.arange(n), k)
+    targets = indices.ravel()
+    weights = scores.ravel()
+
+    # Every edge in both directions, duplicates removed
+    edges = np.stack([np.concatenate([sources, targets]), np.concatenate([targets, sources])], axis=1)
+    edges, first = np.unique(edges, axis=0, return_index=True)
+    edge_weights = np.concatenate([weights, weights])[first]
+
+    degree = np.bincount(edges[:, 0], minlength=n)
+    width = int(degree.max(initial=0)) + 1
+    neighbours = np.repeat(np.arange(n)[:, None], width, axis=1)
+    graph_weights = np.full((n, width), -np.inf)
+    graph_weights[:, 0] = 0.0
+
+    # Slot of each edge within its source's row (edges are sorted by source)
+    starts = np.concatenate([[0], np.cumsum(degree)[:-1]])
+    slots = np.arange(len(edges)) - starts[edges[:, 0]] + 1
+    neighbours[edges[:, 0], slots] = edges[:, 1]
+    graph_weights[edges[:, 0], slots] = edge_weights
+    return neighbours, graph_weights
+
+
+def auction(neighbours, weights, prices=None, epsilon=None, final_epsilon=FINAL_EPSILON, deadline=None):
+    """
+    Maximum-weight assignment of bidders (rows) to seats (neighbour indices).
+
+    Jacobi auction with epsilon scaling: every unassigned bidder bids for its
+    best seat at once, each seat goes to its highest bid, and the losers bid
+    again. `prices` is updated in place so a later call can start warm.
+    Returns (seat[bidder], epsilon); the assignment is within n * epsilon of
+    the best one. Once time.monotonic() passes `deadline`, the last finished
+    phase is returned (the first phase always finishes).
+    """
+    n = len(neighbours)
+    rows = np.arange(n)
+    if prices is None:
+        prices = np.zeros(n)
+    if epsilon is None:
+        epsilon = float(weights[np.isfinite(weights)].max(initial=0.0)) / EPSILON_FACTOR
+    epsilon = max(epsilon, final_epsilon)
+
+    finished = None
+    while True:
+        seat = np.full(n, -1)
+        owner = np.full(n, -1)
+        bidders = rows
+
+        while len(bidders):
+            if finished is not None and time.monotonic() > deadline:
+                return finished
+            values = weights[bidders] - prices[neighbours[bidders]]
+            best = np.argmax(values, axis=1)
+            picked = np.arange(len(bidders))
+            first = values[picked, best]
+            values[picked, best] = -np.inf
+            second = values.max(axis=1)
+            second = np.where(np.isfinite(second), second, first)
+
+            seats = neighbours[bidders, best]
+            bids = prices[seats] + (first - second) + epsilon
+
+            # Highest bid per seat wins; the lower bidder index breaks ties
+            order = np.lexsort((bidders, -bids, seats))
+            winners = order[np.append(True, seats[order][1:] != seats[order][:-1])]
+            won_seats = seats[winners]
+
+            outbid = owner[won_seats]
+            seat[outbid[outbid >= 0]] = -1
+            owner[won_seats] = bidders[winners]
+            seat[bidders[winners]] = won_seats
+            prices[won_seats] = bids[winners]
+
+            bidders = np.flatnonzero(seat < 0)
+
+        if epsilon <= final_epsilon:
+            return seat, epsilon
+        if deadline is not None:
+            finished = seat, epsilon
+            if time.monotonic() > deadline:
+                return finished
+        epsilon = max(epsilon / EPSILON_FACTOR, final_epsilon)
+
+
+def cycles(seat):
+    """Split an assignment into its cycles; fixed points are cycles of one."""
+    seen = np.zeros(len(seat), dtype=bool)
+    found = []
+    for start in range(len(seat)):
+        if seen[start]:
+            continue
+        cycle = [start]
+        seen[start] = True
+        while not seen[seat[cycle[-1]]]:
+            cycle.append(int(seat[cycle[-1]]))
+            seen[cycle[-1]] = True
+        found.append(cycle)
+    return found
+
+
+def pair_up(population, scorer=personality_scores, k=10, block_size=None, workers=1, time_limit=TIME_LIMIT):
+    """
+    Pair users one-to-one so that the total score of all pairs is as high as
+    possible, considering each user's top-k candidates (found with `workers`
+    processes). The solve after top-k takes about `time_limit` seconds at most.
+    """
+    n = len(population)
+    indices, scores = top_k(population, k=k, scorer=scorer, block_size=block_size, workers=workers)
+    deadline = time.monotonic() + time_limit
+    neighbours, weights = candidate_graph(indices, scores)
+
+    weight_of = {}
+    for i, row in enumerate(neighbours.tolist()):
+        for j, weight in zip(row[1:], weights[i, 1:].tolist()):
+            if weight != -np.inf:
+                weight_of[i, j] = weight
+
+    seat, epsilon = auction(neighbours, weights, deadline=deadline)
+
+    # Half of the assignment's value (plus the auction's slack) bounds every
+    # pairing that only uses candidate edges from above
+    upper_bound = (sum(weight_of.get((i, int(seat[i])), 0.0) for i in range(n)) + n * epsilon) / 2
+
+    # Split every cycle into pairs; odd cycles leave one user out...
+    pairs = []
+    for cycle in cycles(seat):
+        pairs.extend(_pair_cycle(cycle, weight_of))
+
+    # ...whom augmenting paths then try to pair up again
+    pairs = _improve(pairs, weight_of, n, deadline=deadline)
+    leftovers = _pair_leftovers(population, scorer, pairs, weight_of)
+
+    pairs = sorted(pairs + leftovers)
+    pair_scores = np.array([weight_of[pair] for pair in pairs])
+    return Pairing(pairs, pair_scores, upper_bound, sum(weight_of[pair] for pair in leftovers))
+
+
+def _improve(pairs, weight_of, n, depth=AUGMENT_DEPTH, deadline=None):
+    """
+    Polish a pairing with short augmenting paths.
+
+    Starting from an unpaired user u, an alternating path pairs u with v,
+    which frees v's old partner w to pair with someone else, and so on for
+    up to `depth` new pairs. The best path from each unpaired user is applied
+    whenever it raises the total, until no path does or `deadline` passes.
+    """
+    neighbours = [[] for _ in range(n)]
+    for (i, j), weight in weight_of.items():
+        neighbours[i].append((weight, j))
+
+    partner = {}
+    for i, j in pairs:
+        partner[i], partner[j] = j, i
+
+    def best_path(u, remaining, on_path):
+        """Best (gain, [(u, v), ...]) of alternating paths starting at free u."""
+        best_gain, best_edges = 0.0, []
+        for weight, v in neighbours[u]:
+            if v in on_path:
+                continue
+            w = partner.get(v)
+            if w is None:
+                gain, edges = weight, [(u, v)]
+            else:
+                gain, edges = weight - weight_of[v, w], [(u, v)]
+                if remaining > 1:
+                    on_path.update((v, w))
+                    more_gain, more_edges = best_path(w, remaining - 1, on_path)
+                    on_path.difference_update((v, w))
+                    gain, edges = gain + more_gain, edges + more_edges
+            if gain > best_gain:
+                best_gain, best_edges = gain, edges
+        return best_gain, best_edges
+
+    improved = True
+    while improved:
+        improved = False
+        for u in range(n):
+            if deadline is not None and time.monotonic() > deadline:
+                improved = False
+                break
+            if u in partner:
+                continue
+            gain, edges = best_path(u, depth, {u})
+            if gain <= 1e-12:
+                continue
+
+            # Break the old pairs along the path, then make the new ones
+            for a, b in edges:
+                old = partner.pop(b, None)
+                if old is not None:
+                    partner.pop(old, None)
+            for a, b in edges:
+                partner[a], partner[b] = b, a
+            improved = True
+
+    return sorted((i, j) for i, j in partner.items() if i < j)
+
+
+def _pair_leftovers(population, scorer, pairs, weight_of):
+    """
+    Pair the users still unpaired with each other, best scores first. No
+    candidate edge helps them any more, but every pair scores at least 0.
+    Returns the new pairs; their edges are added to `weight_of`.
+    """
+    paired = {user for pair in pairs for user in pair}
+    free = np.array([i for i in range(len(population)) if i not in paired], dtype=np.int64)
+    if len(free) < 2:
+        return []
+
+    preferences = population.preferences[free] if population.preferences is not None else None
+    leftovers = Population(population.user_ids[free], population.weights[free], preferences)
+    scores = scorer(leftovers, 0, len(free))
+    a, b = np.triu_indices(len(free), 1)
+    order = np.argsort(-scores[a, b], kind='stable')
+
+    taken = np.zeros(len(free), dtype=bool)
+    pairs = []
+    for x, y in zip(a[order].tolist(), b[order].tolist()):
+        if taken[x] or taken[y]:
+            continue
+        taken[x] = taken[y] = True
+        i, j = int(free[x]), int(free[y])
+        weight_of[i, j] = weight_of[j, i] = float(scores[x, y])
+        pairs.append((i, j))
+        if 2 * len(pairs) >= len(free) - 1:
+            break
+    return pairs
+
+
+def _pair_cycle(cycle, weight_of):
+    """Best set of disjoint pairs along one cycle of the assignment."""
+    if len(cycle) < 2:
+        return []
+    if len(cycle) == 2:
+        return [tuple(sorted(cycle))]
+
+    # Consecutive users in the cycle are connected; pick the best alternating
+    # set of edges along the path that starts at each possible cut point
+    best, best_weight = [], -1.0
+    cuts = range(2) if len(cycle) % 2 == 0 else range(len(cycle))
+    for cut in cuts:
+        path = cycle[cut:] + cycle[:cut]
+        edges = [tuple(sorted(path[i:i + 2])) for i in range(0, len(path) - 1, 2)]
+        weight = sum(weight_of[edge] for edge in edges)
+        if weight > best_weight:
+            best, best_weight = edges, weight
+    return best
@@ -0,0 +1,175 @@
+"""
+Shared cache helpers.
+
+Everything here goes through the default cache from settings.CACHES, so with
+the file or redis backend every worker sees the same entries. Per-user values
+are cached under predictable keys and dropped as soon as the data behind them
+changes, so pages never show stale quiz results.
+
+A per-process backend (locmem) can only drop entries in the process that made
+the change; other web workers and match_worker never reach it. There every
+entry lives at most LOCAL_TIMEOUT seconds (see timeout_for), which still
+absorbs a rush of page loads without showing stale data for long.
+
+Models import this module to invalidate entries on save, so model imports
+here happen inside the functions that need them. Every lookup is counted
+in metrics, which /metrics turns into a hit ratio per cache.
+"""
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .metrics import cache_lookup
+
+# Upper bound on how long a dashboard context lives if nothing invalidates it
+DASHBOARD_TIMEOUT = 60 * 60
+
+# Match lists are keyed by generation, so a full run never needs to clear them
+MATCHES_TIMEOUT = 60 * 60
+
+ACTIVE_GENERATION_KEY = 'matches:active'
+
+# Stored for users without a personality quiz, since the cache can't hold None
+NO_CATEGORY = ''
+
+# Longest any entry lives in a per-process cache, which other processes can't invalidate
+LOCAL_TIMEOUT = 5
+
+
+def dashboard_key(user_id):
+    return f'dashboard:{user_id}'
+
+
+def active_generation_key(event_id=None):
+    return ACTIVE_GENERATION_KEY if event_id is None else f'{ACTIVE_GENERATION_KEY}:{event_id}'
+
+
+def matches_key(generation_id, user_id):
+    return f'matches:{generation_id}:{user_id}'
+
+
+def category_key(user_id):
+    return f'category:{user_id}'
+
+
+async def cached_dashboard(user_id, build):
+    """The cached dashboard context for `user_id`, awaiting build(user_id) on a miss."""
+    key = dashboard_key(user_id)
+    context = await cache.aget(key)
+    if context is None:
+        cache_lookup('dashboard', misses=1)
+        context = await build(user_id)
+        await cache.aset(key, context, timeout_for(DASHBOARD_TIMEOUT))
+    else:
+        cache_lookup('dashboard', hits=1)
+    return context
+
+
+def active_generation_id(event_id=None):
+    """
+    Primary key of the active site-wide MatchGeneration, or of `event_id`'s,
+    or None before the first run.
+    """
+    key = active_generation_key(event_id)
+    generation_id = cache.get(key)
+    cache_lookup('active_generation', hits=generation_id is not None, misses=generation_id is None)
+    if generation_id is None:
+        from .models import MatchGeneration
+        generation_id = (
+            MatchGeneration.objects.filter(is_active=True, event_id=event_id)
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if generation_id is not None:
+            cache.set(key, generation_id, timeout_for(MATCHES_TIMEOUT))
+    return generation_id
+
+
+def timeout_for(timeout):
+    """`timeout` with a shared backend; at most LOCAL_TIMEOUT with a per-process one."""
+    if isinstance(caches['default'], (LocMemCache, DummyCache)):
+        return min(timeout, LOCAL_TIMEOUT)
+    return timeout
+
+
+def match_list(user_id, event_id=None):
+    """
+    `user_id`'s matches in the active site-wide generation (or `event_id`'s),
+    best first, as dicts with match_id, username, score and rank.
+    """
+    generation_id = active_generation_id(event_id)
+    if generation_id is None:
+        return []
+
+    key = matches_key(generation_id, user_id)
+    matches = cache.get(key)
+    if matches is not None:
+        cache_lookup('matches', hits=1)
+        return matches
+
+    cache_lookup('matches', misses=1)
+    from .models import MatchResult
+    rows = (
+        MatchResult.objects.filter(generation_id=generation_id, user_id=user_id)
+        .order_by('rank')
+        .values_list('match_id', 'match__username', 'score', 'rank')
+    )
+    matches = [
+        {'match_id': match_id, 'username': username, 'score': score, 'rank': rank}
+        for match_id, username, score, rank in rows
+    ]
+    cache.set(key, matches, timeout_for(MATCHES_TIMEOUT))
+    return matches
+
+
+def category_of(user_id):
+    """`user_id`'s personality category, or None if they haven't done the quiz."""
+    category = cache.get(category_key(user_id))
+    cache_lookup('category', hits=category is not None, misses=category is None)
+    if category is None:
+        from .models import PersonalityQuiz
+        category = (
+            PersonalityQuiz.objects.filter(user_id=user_id)
+            .values_list('category_classification', flat=True)
+            .first()
+        ) or NO_CATEGORY
+        cache.set(category_key(user_id), category, timeout_for(DASHBOARD_TIMEOUT))
+    return category or None
+
+
+def categories_of(user_ids):
+    """{user_id: category or None} for many users, with one query for all the misses."""
+    found = cache.get_many([category_key(user_id) for user_id in user_ids])
+    categories = {user_id: found.get(category_key(user_id)) for user_id in user_ids}
+
+    missing = [user_id for user_id, category in categories.items() if category is None]
+    cache_lookup('category', hits=len(categories) - len(missing), misses=len(missing))
+    if missing:
+        from .models import PersonalityQuiz
+        loaded = dict(
+            PersonalityQuiz.objects.filter(user_id__in=missing).values_list('user_id', 'category_classification')
+        )
+        for user_id in missing:
+            categories[user_id] = loaded.get(user_id) or NO_CATEGORY
+        cache.set_many(
+            {category_key(user_id): categories[user_id] for user_id in missing}, timeout_for(DASHBOARD_TIMEOUT)
+        )
+
+    return {user_id: category or None for user_id, category in categories.items()}
+
+
+def invalidate_quizzes(*user_ids):
+    """Drop everything cached from the quizzes of every user in `user_ids`."""
+    cache.delete_many(
+        [dashboard_key(user_id) for user_id in user_ids] + [category_key(user_id) for user_id in user_ids]
+    )
+
+
+def invalidate_matches(generation_id, *user_ids):
+    """Drop the cached match lists of `user_ids` in one generation."""
+    cache.delete_many([matches_key(generation_id, user_id) for user_id in user_ids])
+
+
+def forget_active_generation(event_id=None):
+    """Make the next match_list() look the active generation (site-wide or `event_id`'s) up again."""
+    cache.delete(active_generation_key(event_id))
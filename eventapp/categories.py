@@ -0,0 +1,22 @@
+"""
+The personality category groups, as plain data.
+
+Kept apart from classification.py so that importing the models doesn't pull
+in NumPy; classification.py compiles these into its centroid index the
+first time a quiz is classified.
+"""
+
+# Preset category groups by color with target weights for each category
+# Category 0: AntiSocial (1) -> Social (5)
+# Category 1: Books (1) -> Movies (5)
+# Category 2: Less Romantic (1) -> More Romantic (5)
+CATEGORY_GROUPS = {
+    'Purple': {'weights': [5.0, 5.0, 5.0], 'description': 'Social, Movies, More Romantic'},
+    'red': {'weights': [3, 3, 3], 'description': 'Balanced'},
+    'gray': {'weights': [1.0, 1.0, 1.0], 'description': 'AntiSocial, Books, Less Romantic'},
+    'green': {'weights': [4.0, 2.0, 5.0], 'description': 'Social, Books, More Romantic'},
+    'blue': {'weights': [5.0, 5.0, 1.0], 'description': 'Social, Movies, Less Romantic'},
+    'pink': {'weights': [2.0, 1.0, 5.0], 'description': 'Moderate Social, Books, More Romantic'},
+    'orange': {'weights': [1.0, 5.0, 1.0], 'description': 'AntiSocial, Movies, Less Romantic'},
+    'beige': {'weights': [3.0, 4.0, 2], 'description': 'Moderate Social, Movies, Less Romantic'},
+}
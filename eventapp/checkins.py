@@ -0,0 +1,292 @@
+"""
+Live check-in notifications.
+
+Every open event page holds a Server-Sent Events stream (see
+views.event_stream; without ASGI the page polls instead). The stream
+subscribes to the process-wide HUB with its event and the user ids of its
+top-3 matches, and the hub keeps a reverse index from each watched (event,
+match) to the subscriptions watching them. Arriving at one event doesn't
+light anything up on another event's pages. When somebody checks in,
+only those subscriptions are woken; nobody else's page does any work.
+
+Check-ins made in this process are pushed straight away. A single poller
+thread per process also tails the CheckIn table while anyone is subscribed,
+so check-ins written by other workers (or through the admin) arrive within
+POLL_SECONDS, at the cost of one query per process rather than per page.
+
+Door scans go through WRITER instead of writing one row per request: scans
+are queued in memory and a flusher thread writes everything that arrived in
+the last FLUSH_SECONDS in one transaction, then notifies the hub.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import CheckIn
+
+logger = logging.getLogger(__name__)
+
+# How often the poller looks for check-ins written by other processes
+POLL_SECONDS = 1.0
+
+# How many matches an event page shows lights for
+WATCHED_MATCHES = 3
+
+# How long the flusher lets scans pile up before writing them together
+FLUSH_SECONDS = 0.005
+
+# Most rows written per INSERT
+FLUSH_BATCH_SIZE = 500
+
+# Pause before retrying after a failed write (e.g. the database is locked)
+RETRY_SECONDS = 1.0
+
+
+class Subscription:
+    """One open stream: an asyncio queue fed from any thread."""
+
+    def __init__(self, user_id, watched, event_id=None):
+        self.user_id = user_id
+        self.event_id = event_id
+        self.watched = [(event_id, match_id) for match_id in watched]
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def push(self, event):
+        # Publishers run on request threads or the poller, never on this loop
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            pass  # The loop already shut down; its stream is gone
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class CheckInHub:
+    """Routes check-ins to the subscriptions watching the user who checked in."""
+
+    def __init__(self, poll_seconds=POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._watchers = defaultdict(set)  # (event id, match user id) -> subscriptions watching them
+        self._subscriptions = 0
+        self._poller = None
+
+    def subscribe(self, user_id, watched, event_id=None):
+        """
+        Start watching `watched` user ids arrive at `event_id` (None for the
+        site-wide event night); must be called from the stream's event loop.
+        """
+        subscription = Subscription(user_id, watched, event_id)
+        with self._lock:
+            for key in subscription.watched:
+                self._watchers[key].add(subscription)
+            self._subscriptions += 1
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='checkin-poller', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for key in subscription.watched:
+                watchers = self._watchers.get(key)
+                if watchers is not None:
+                    watchers.discard(subscription)
+                    if not watchers:
+                        del self._watchers[key]
+            self._subscriptions -= 1
+
+    def publish(self, user_id, checked_in_at, event_id=None):
+        """Tell everyone watching `user_id` at `event_id` that they checked in. Safe from any thread."""
+        with self._lock:
+            watchers = list(self._watchers.get((event_id, user_id), ()))
+        event = {'user_id': user_id, 'checked_in_at': checked_in_at.isoformat()}
+        for subscription in watchers:
+            subscription.push(event)
+        return len(watchers)
+
+    def _poll(self):
+        """Tail the CheckIn table while anyone is subscribed, then exit."""
+        try:
+            last_id = CheckIn.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            while True:
+                time.sleep(self.poll_seconds)
+                with self._lock:
+                    if not self._subscriptions:
+                        self._poller = None
+                        return
+
+                close_old_connections()
+                rows = list(
+                    CheckIn.objects.filter(pk__gt=last_id).order_by('pk')
+                    .values_list('pk', 'user_id', 'checked_in_at', 'event_id')
+                )
+                # Local check-ins come round a second time; an event only
+                # turns a light on, so the repeat is harmless
+                for last_id, user_id, checked_in_at, event_id in rows:
+                    self.publish(user_id, checked_in_at, event_id)
+        finally:
+            with self._lock:
+                if self._poller is threading.current_thread():
+                    self._poller = None
+            connection.close()
+
+
+HUB = CheckInHub()
+
+
+class CheckInWriter:
+    """
+    Queues door scans in memory and writes them in grouped transactions.
+
+    submit() only reads: it sorts the scanned ids into unknown users (or,
+    at an event, users who aren't attending), users already checked in, and
+    new arrivals, queues the new arrivals and returns. A flusher thread bulk
+    inserts whatever is queued every FLUSH_SECONDS. The CheckIn row is
+    unique per user and event, so repeats (a double scan, two volunteers,
+    two workers) are ignored by the insert. Only the queue lives in memory;
+    whether somebody has already checked in is always read from the table,
+    so rows deleted or written elsewhere are seen straight away.
+
+    A batch that fails on a bad row (say a user deleted after their scan was
+    queued) is written again one scan at a time, and only the rows that still
+    fail are dropped. Other failures, like a locked database, put the whole
+    batch back to be retried.
+    """
+
+    def __init__(self, flush_seconds=FLUSH_SECONDS, batch_size=FLUSH_BATCH_SIZE, hub=None):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.hub = hub or HUB
+        self._condition = threading.Condition()
+        self._pending = {}  # (event id, user id) -> None; a dict keeps arrival order and drops repeats
+        self._flusher = None
+
+    def submit(self, user_ids, event=None):
+        """
+        Queue a scan or batch of scans at `event` (None for the site-wide event
+        night). Returns the ids sorted into accepted, already_checked_in and unknown.
+        """
+        event_id = event.pk if event else None
+        user_ids = list(dict.fromkeys(user_ids))
+        with self._condition:
+            fresh = {user_id for user_id in user_ids if (event_id, user_id) not in self._pending}
+
+        # One indexed read tells unknown ids and existing check-ins apart
+        found = {}
+        if fresh:
+            users = get_user_model().objects.filter(pk__in=fresh)
+            if event is not None:
+                users = users.filter(events=event)
+            found = dict(users.annotate(
+                arrived=Exists(CheckIn.objects.filter(user=OuterRef('pk'), event_id=event_id))
+            ).values_list('pk', 'arrived'))
+
+        accepted, already, unknown = [], [], []
+        with self._condition:
+            for user_id in user_ids:
+                key = (event_id, user_id)
+                # Queued at the first look (maybe written since), queued now, or already in the table
+                if user_id not in fresh or key in self._pending or found.get(user_id):
+                    already.append(user_id)
+                elif user_id not in found:
+                    unknown.append(user_id)
+                else:
+                    self._pending[key] = None
+                    accepted.append(user_id)
+
+            if accepted:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run, name='checkin-writer', daemon=True)
+                    self._flusher.start()
+                self._condition.notify()
+
+        return {'accepted': accepted, 'already_checked_in': already, 'unknown': unknown}
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything queued right now on the calling thread; returns rows written."""
+        with self._condition:
+            batch = list(self._pending)
+            self._pending.clear()
+        if not batch:
+            return 0
+        try:
+            return self._write(batch)
+        except IntegrityError:
+            return self._write_each(batch)
+        except Exception:
+            self._requeue(batch)
+            raise
+
+    def _write_each(self, batch):
+        """Write the scans of a failed batch one by one, dropping those that can't be written."""
+        written = 0
+        for index, key in enumerate(batch):
+            try:
+                written += self._write([key])
+            except IntegrityError:
+                event_id, user_id = key
+                logger.warning("Dropping the check-in of user %s (event %s)", user_id, event_id, exc_info=True)
+            except Exception:
+                self._requeue(batch[index:])
+                raise
+        return written
+
+    def _requeue(self, batch):
+        """Put scans back in front of the queue so the next flush retries them."""
+        with self._condition:
+            self._pending = {**dict.fromkeys(batch), **self._pending}
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._pending:
+                        self._condition.wait()
+                # Give concurrent scans a moment to join this batch
+                time.sleep(self.flush_seconds)
+                close_old_connections()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Writing queued check-ins failed; retrying")
+                    time.sleep(RETRY_SECONDS)
+        finally:
+            connection.close()
+
+    def _write(self, batch):
+        by_event = defaultdict(list)
+        for event_id, user_id in batch:
+            by_event[event_id].append(user_id)
+
+        rows = []
+        with transaction.atomic():
+            for event_id, user_ids in by_event.items():
+                existing = set(
+                    CheckIn.objects.filter(event_id=event_id, user_id__in=user_ids).values_list('user_id', flat=True)
+                )
+                rows += [CheckIn(user_id=user_id, event_id=event_id) for user_id in user_ids if user_id not in existing]
+            CheckIn.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+
+        for row in rows:
+            self.hub.publish(row.user_id, row.checked_in_at, row.event_id)
+        return len(rows)
+
+
+WRITER = CheckInWriter()
+
+# Don't lose scans that are still queued when the process exits
+atexit.register(WRITER.flush)
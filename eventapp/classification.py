@@ -0,0 +1,54 @@
+"""
+Nearest-centroid classification of quiz vectors.
+
+CATEGORY_GROUPS is compiled once at import time into a list of names and a
+centroid array, so classifying a single quiz or a whole table of them is one
+vectorized nearest-centroid call.
+"""
+import numpy as np
+
+from .categories import CATEGORY_GROUPS
+
+# How much each of the 9 personality answers counts towards each category
+# Category 0: q0=0.3, q3=0.2, q6=0.5
+# Category 1: q1=1/3, q4=1/3, q7=1/3 (equal)
+# Category 2: q2=0.6, q5=0.2, q8=0.2
+ANSWER_WEIGHTS = np.zeros((9, 3))
+ANSWER_WEIGHTS[[0, 3, 6], 0] = [0.3, 0.2, 0.5]
+ANSWER_WEIGHTS[[1, 4, 7], 1] = [1/3, 1/3, 1/3]
+ANSWER_WEIGHTS[[2, 5, 8], 2] = [0.6, 0.2, 0.2]
+
+
+class CentroidIndex:
+    """Finds the closest category group (by Euclidean distance) for quiz vectors."""
+
+    def __init__(self, groups):
+        self.names = list(groups)
+        self.centroids = np.array([group['weights'] for group in groups.values()], dtype=np.float64)
+
+    def nearest(self, vectors):
+        """Index of the closest centroid for every row of `vectors`; ties go to the first group."""
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, self.centroids.shape[1])
+        # Accumulate one coordinate at a time, in the same order as the
+        # original per-row loop, so near-ties resolve exactly as they always have
+        squared = np.zeros((len(vectors), len(self.centroids)))
+        for column in range(self.centroids.shape[1]):
+            squared += (vectors[:, None, column] - self.centroids[None, :, column]) ** 2
+        return np.sqrt(squared).argmin(axis=1)
+
+    def classify(self, vector):
+        """Name of the closest category group for one vector."""
+        return self.names[self.nearest(vector)[0]]
+
+    def classify_many(self, vectors):
+        """Names of the closest category groups for a batch of vectors."""
+        return [self.names[i] for i in self.nearest(vectors).tolist()]
+
+
+CATEGORY_INDEX = CentroidIndex(CATEGORY_GROUPS)
+
+
+def weights_from_answers(answers):
+    """Calculated weights (rounded to two decimals) for a batch of 9-answer rows."""
+    answers = np.asarray(answers, dtype=np.float64).reshape(-1, 9)
+    return np.round(answers @ ANSWER_WEIGHTS, 2)
@@ -0,0 +1,125 @@
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from eventapp import match_store
+from eventapp.models import PersonalityQuiz
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent quiz submissions on a scratch SQLite database using the "
+        "current settings. Run it once with DB_SQLITE_TUNING=0 and once with "
+        "DB_SQLITE_TUNING=1 to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help="Threads submitting at the same time, like concurrent requests (default 8)."
+        )
+        parser.add_argument(
+            '--submissions', type=int, default=50,
+            help="Quiz submissions per worker (default 50)."
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Seed for the generated answers (default 0)."
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_sqlite only runs against a SQLite database.")
+
+        workers = options['workers']
+        per_worker = options['submissions']
+
+        with tempfile.TemporaryDirectory() as scratch:
+            # Point the default database at a throwaway file so the real one is never touched
+            connection.close()
+            connection.settings_dict['NAME'] = Path(scratch) / 'bench.sqlite3'
+            call_command('migrate', verbosity=0)
+
+            with connection.cursor() as cursor:
+                pragmas = {
+                    name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                    for name in ('journal_mode', 'synchronous', 'mmap_size', 'cache_size')
+                }
+            options_in_use = connection.settings_dict.get('OPTIONS', {})
+            self.stdout.write(
+                f"SQLite {pragmas} transaction_mode={options_in_use.get('transaction_mode') or 'DEFERRED'} "
+                f"timeout={options_in_use.get('timeout', 5)}s CONN_MAX_AGE={connection.settings_dict['CONN_MAX_AGE']}"
+            )
+
+            User = get_user_model()
+            User.objects.bulk_create(
+                [User(username=f'bench{i}', password='!') for i in range(workers * per_worker)]
+            )
+            user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+            # Start from an (empty) active generation, like a site after its first run
+            match_store.publish([], [], [], prune=False)
+
+            rng = random.Random(options['seed'])
+            answers = [[rng.randint(1, 5) for _ in range(9)] for _ in user_ids]
+            latencies = []
+            errors = []
+            lock = threading.Lock()
+
+            def submit(user_id, user_answers):
+                """One quiz submission, doing what personality_quiz_view does."""
+                started = time.perf_counter()
+                try:
+                    User.objects.select_related('personality_quiz', 'attraction_quiz').get(pk=user_id)
+                    PersonalityQuiz.objects.filter(user_id=user_id).exists()
+                    PersonalityQuiz(user_id=user_id, answers=user_answers).save()
+                    match_store.update_user_matches(user_id)
+                except OperationalError as error:
+                    with lock:
+                        errors.append(str(error))
+                    return
+                finally:
+                    # End of "request": closes the connection unless CONN_MAX_AGE keeps it
+                    close_old_connections()
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+            def worker(chunk):
+                try:
+                    for user_id, user_answers in chunk:
+                        submit(user_id, user_answers)
+                finally:
+                    connections.close_all()
+
+            jobs = list(zip(user_ids, answers))
+            threads = [
+                threading.Thread(target=worker, args=(jobs[i::workers],))
+                for i in range(workers)
+            ]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            connections.close_all()
+
+        done = len(latencies)
+        self.stdout.write(
+            f"{done} of {len(jobs)} submissions in {elapsed:.2f}s ({done / elapsed:,.1f}/s) "
+            f"with {workers} workers; {len(errors)} failed."
+        )
+        if latencies:
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            self.stdout.write(f"Latency p50 {p50:.1f} ms, p99 {p99:.1f} ms.")
+        if errors:
+            self.stdout.write(self.style.WARNING(
+                f"Most common error: {max(set(errors), key=errors.count)!r}"
+            ))
@@ -0,0 +1,267 @@
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import django
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from eventapp import match_store, synthetic
+from eventapp.assignment import pair_up
+from eventapp.matching import SCORERS, Population, top_k
+from eventapp.models import PersonalityQuiz
+
+# Population sizes the suite accepts
+MIN_SIZE = 100
+MAX_SIZE = 50_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Time quiz classification, full and incremental matching and the dashboard and quiz "
+        "views on synthetic populations, each on a scratch SQLite database. Results can be "
+        "written as JSON and compared against an earlier run with regression thresholds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='100,1000,10000',
+            help=f"Comma-separated attendee counts, each {MIN_SIZE}-{MAX_SIZE} (default 100,1000,10000)."
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Runs of each request and incremental update; the median is reported (default 5)."
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Seed for the synthetic population (default 0)."
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help="Write the results as JSON to this file (use it as the next run's --baseline)."
+        )
+        parser.add_argument(
+            '--baseline', default=None,
+            help="Earlier results to compare against; exits with an error on a regression."
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help="How much slower than the baseline counts as a regression (default 0.2, i.e. 20%%)."
+        )
+        parser.add_argument(
+            '--min-delta', type=float, default=2.0,
+            help="Slowdowns smaller than this many milliseconds are treated as noise (default 2)."
+        )
+        parser.add_argument(
+            '--workers', default=None,
+            help="Comma-separated process counts to also time the scoring step with, e.g. 1,2,4,8."
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("benchmark only runs against a SQLite database.")
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes takes comma-separated integers.")
+        if any(not MIN_SIZE <= size <= MAX_SIZE for size in sizes):
+            raise CommandError(f"Sizes must be between {MIN_SIZE} and {MAX_SIZE}.")
+        self.repeat = max(1, options['repeat'])
+        self.seed = options['seed']
+        self.workers = []
+        if options['workers']:
+            try:
+                self.workers = [int(count) for count in options['workers'].split(',')]
+            except ValueError:
+                raise CommandError("--workers takes comma-separated integers.")
+            if any(count < 1 for count in self.workers):
+                raise CommandError("Worker counts must be at least 1.")
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as source:
+                baseline = json.load(source)
+
+        # The test client needs the test environment (allowed hosts, in-memory email),
+        # and a private cache keeps the benchmark away from a shared one
+        setup_test_environment()
+        results = {}
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark',
+        }}):
+            for size in sizes:
+                self.stdout.write(f"{size} attendees:")
+                with tempfile.TemporaryDirectory() as scratch:
+                    results[str(size)] = self.run_size(size, Path(scratch) / 'benchmark.sqlite3')
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+            },
+            'seed': self.seed,
+            'repeat': self.repeat,
+            'unit': 'ms',
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}."))
+
+        if baseline is not None:
+            self.compare(results, baseline, options['threshold'], options['min_delta'])
+
+    def run_size(self, size, path):
+        """Every measurement for one population size, on a fresh database at `path`."""
+        # Point the default database at a throwaway file so the real one is never touched
+        connection.close()
+        connection.settings_dict['NAME'] = path
+        call_command('migrate', verbosity=0)
+        cache.clear()
+
+        timings = {}
+
+        started = time.perf_counter()
+        user_ids = synthetic.create_attendees(size, seed=self.seed)
+        timings['load_population'] = self.elapsed(started)
+
+        # Classification the way save() does it, one quiz at a time
+        personality, _ = synthetic.answers(size, seed=self.seed)
+        quizzes = [PersonalityQuiz(answers=row) for row in personality.tolist()]
+        started = time.perf_counter()
+        for quiz in quizzes:
+            quiz.calculate_weighted_averages()
+            quiz.classify_category()
+        timings['classify_quizzes'] = self.elapsed(started)
+
+        # Full runs, loading through publishing, like run_matching
+        for scoring in ('personality', 'mutual'):
+            started = time.perf_counter()
+            population = Population.load(scoring)
+            indices, scores = top_k(population, k=3, scorer=SCORERS[scoring])
+            match_store.publish(
+                population.user_ids.tolist(), population.user_ids[indices].tolist(), scores.tolist(),
+                scoring=scoring, prune=False,
+            )
+            timings[f'full_matching_{scoring}'] = self.elapsed(started)
+
+            # Scoring alone on a process pool, for scaling numbers
+            for workers in self.workers:
+                started = time.perf_counter()
+                top_k(population, k=3, scorer=SCORERS[scoring], workers=workers)
+                timings[f'scoring_{scoring}_{workers}_workers'] = self.elapsed(started)
+
+        # One-to-one pairing; the synthetic Likert answers tie a lot, which is
+        # what makes the solver work hard
+        started = time.perf_counter()
+        pair_up(Population.load('personality'))
+        timings['assignment_personality'] = self.elapsed(started)
+
+        # One submission patched into the active (mutual) generation
+        sample = user_ids[:: max(1, size // self.repeat)][: self.repeat]
+        timings['incremental_matching'] = self.median(
+            lambda user_id: match_store.update_user_matches(user_id), sample
+        )
+
+        # Requests through the whole stack, for attendees who have done both quizzes
+        client = Client()
+        attendees = get_user_model().objects.in_bulk(sample)
+
+        def dashboard(user_id, warm):
+            client.force_login(attendees[user_id])
+            if warm:
+                self.get(client, '/dashboard/', 200)
+            else:
+                cache.clear()
+            started = time.perf_counter()
+            self.get(client, '/dashboard/', 200)
+            return self.elapsed(started)
+
+        timings['dashboard_cold'] = statistics.median(dashboard(user_id, warm=False) for user_id in sample)
+        timings['dashboard_warm'] = statistics.median(dashboard(user_id, warm=True) for user_id in sample)
+
+        # ...and for newcomers taking the personality quiz
+        newcomers = get_user_model().objects.bulk_create(
+            [get_user_model()(username=f'newcomer{i}', password='!') for i in range(self.repeat)]
+        )
+        answers = {f'q{i}': '3' for i in range(len(PersonalityQuiz.QUESTIONS))}
+
+        def take_quiz(user, method):
+            client.force_login(user)
+            started = time.perf_counter()
+            if method == 'GET':
+                self.get(client, '/quiz/', 200)
+            else:
+                response = client.post('/quiz/', answers)
+                if response.status_code != 302:
+                    raise CommandError(f"POST /quiz/ answered {response.status_code}.")
+            return self.elapsed(started)
+
+        timings['quiz_form'] = statistics.median(take_quiz(user, 'GET') for user in newcomers)
+        timings['quiz_submit'] = statistics.median(take_quiz(user, 'POST') for user in newcomers)
+
+        connection.close()
+        for name, ms in timings.items():
+            self.stdout.write(f"  {name:<28} {ms:10.2f} ms")
+        return timings
+
+    def get(self, client, path, status):
+        response = client.get(path)
+        if response.status_code != status:
+            raise CommandError(f"GET {path} answered {response.status_code}, expected {status}.")
+        return response
+
+    def median(self, measure, items):
+        def timed(item):
+            started = time.perf_counter()
+            measure(item)
+            return self.elapsed(started)
+        return statistics.median(timed(item) for item in items)
+
+    def elapsed(self, started):
+        return (time.perf_counter() - started) * 1000
+
+    def compare(self, results, baseline, threshold, min_delta):
+        """Print every timing against the baseline; raise if anything regressed."""
+        self.stdout.write(f"Against the baseline from {baseline.get('created_at', 'an earlier run')}:")
+        regressions = []
+        for size, timings in results.items():
+            before = baseline.get('results', {}).get(size)
+            if before is None:
+                self.stdout.write(f"  {size}: not in the baseline")
+                continue
+            for name, ms in timings.items():
+                if name not in before:
+                    continue
+                ratio = ms / before[name] if before[name] else float('inf')
+                regressed = ratio > 1 + threshold and ms - before[name] > min_delta
+                line = f"  {size:>6} {name:<28} {before[name]:10.2f} -> {ms:10.2f} ms  ({ratio:5.2f}x)"
+                if regressed:
+                    regressions.append(f"{size} {name}")
+                    self.stdout.write(self.style.ERROR(line))
+                elif ratio < 1 - threshold:
+                    self.stdout.write(self.style.SUCCESS(line))
+                else:
+                    self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} regression(s) beyond {threshold:.0%}: {', '.join(regressions)}"
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions."))
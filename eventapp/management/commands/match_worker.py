@@ -0,0 +1,72 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from eventapp import scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued matching jobs as they come due, patching or fully rerunning each scope's matches "
+        "(see eventapp/scheduler.py). Run a single worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help="Most seconds to wait between looks at the queue (default 1)."
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Run the jobs that are due now, then exit."
+        )
+
+    def handle(self, *args, **options):
+        if options['poll'] <= 0:
+            raise CommandError("--poll must be positive.")
+        if settings.CACHE_BACKEND == 'locmem':
+            self.stdout.write(self.style.WARNING(
+                "The cache is per process (CACHE_BACKEND=locmem), so web workers only see this worker's "
+                "changes once their entries expire (a few seconds). Use the file or redis backend with a worker."
+            ))
+
+        # Finish the current job on SIGTERM (a deploy or restart) instead of dying halfway
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+
+        interrupted = scheduler.requeue_interrupted()
+        if interrupted:
+            self.stdout.write(f"Queued the users of {interrupted} interrupted job(s) again.")
+
+        self.stdout.write("Waiting for matching jobs.")
+        while not self.stopping:
+            # Like a request would, drop connections that timed out or broke while idle
+            close_old_connections()
+            job = scheduler.claim_next()
+            if job is None:
+                if options['once']:
+                    break
+                due_in = scheduler.seconds_until_due()
+                time.sleep(options['poll'] if due_in is None else min(options['poll'], max(due_in, 0.05)))
+                continue
+
+            scheduler.run_job(job, stdout=self.stdout if options['verbosity'] > 1 else None)
+            self.report(job)
+            scheduler.prune_jobs()
+
+    def stop(self, signum, frame):
+        self.stdout.write("Stopping after the current job.")
+        self.stopping = True
+
+    def report(self, job):
+        scope = f"event {job.event.slug}" if job.event_id else "site-wide"
+        line = (
+            f"Job {job.pk} ({scope}): {job.kind} run for {job.dirty_count} dirty user(s) "
+            f"{'done' if job.state == 'done' else 'failed'} in {job.duration:.2f}s."
+        )
+        if job.state == 'failed':
+            line += " Queued again." if job.attempt < scheduler.MAX_ATTEMPTS else " Giving up on its users."
+        self.stdout.write(self.style.SUCCESS(line) if job.state == 'done' else self.style.ERROR(line))
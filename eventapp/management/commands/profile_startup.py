@@ -0,0 +1,182 @@
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from eventapp import urls as eventapp_urls
+
+# Runs in a fresh interpreter: loads settings, the app registry and the
+# URLconf, optionally serves one request, and prints its timings as JSON
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+from django.conf import settings
+imported = time.perf_counter()
+settings.INSTALLED_APPS
+configured = time.perf_counter()
+django.setup()
+ready = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+routed = time.perf_counter()
+result = {
+    'django_import_ms': (imported - started) * 1000,
+    'settings_ms': (configured - imported) * 1000,
+    'app_registry_ms': (ready - configured) * 1000,
+    'urlconf_ms': (routed - ready) * 1000,
+}
+if len(sys.argv) > 1:
+    from django.test import Client
+    client = Client()
+    if len(sys.argv) > 2:
+        from django.contrib.auth import get_user_model
+        client.force_login(get_user_model().objects.get(username=sys.argv[2]))
+    before = time.perf_counter()
+    response = client.get(sys.argv[1])
+    if response.streaming:
+        response.close()  # Time to headers; the stream itself never ends
+    done = time.perf_counter()
+    result['status'] = response.status_code
+    result['response_ms'] = (done - before) * 1000
+    result['first_response_ms'] = (done - started) * 1000 - (before - routed) * 1000
+print(json.dumps(result))
+'''
+
+# "import time: self [us] | cumulative | imported package" lines from -X importtime
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+\d+\s+\|\s*(\S+)\s*$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile cold starts: import cost per package, app registry load time, and time "
+        "to first response for every URL in eventapp/urls.py, each in a fresh interpreter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help="Cold starts per measurement; the median is reported (default 3)."
+        )
+        parser.add_argument(
+            '--user', default=None,
+            help="Username to log in as for the URL probes (default: anonymous)."
+        )
+        parser.add_argument(
+            '--top', type=int, default=15,
+            help="How many packages to list in the import table (default 15)."
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help="Also write the results as JSON to this file ('-' for stdout)."
+        )
+
+    def handle(self, *args, **options):
+        self.repeat = max(1, options['repeat'])
+        # manage.py has set DJANGO_SETTINGS_MODULE, so the probes load the same settings
+        self.env = dict(os.environ)
+
+        imports = self.profile_imports()
+        startup = self.profile_startup()
+        urls = self.profile_urls(options['user'])
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'settings': os.environ['DJANGO_SETTINGS_MODULE'],
+            'repeat': self.repeat,
+            'user': options['user'],
+            'imports_ms': imports,
+            'startup_ms': startup,
+            'urls': urls,
+        }
+
+        self.report(results, options['top'])
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}."))
+
+    def probe(self, *argv, importtime=False):
+        """Run PROBE in a fresh interpreter; returns (timings, wall ms, stderr)."""
+        command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE, *argv]
+        started = time.perf_counter()
+        completed = subprocess.run(command, env=self.env, capture_output=True, text=True)
+        wall = (time.perf_counter() - started) * 1000
+        if completed.returncode != 0:
+            raise CommandError(f"Startup probe failed:\n{completed.stderr[-2000:]}")
+        return json.loads(completed.stdout.strip().splitlines()[-1]), wall, completed.stderr
+
+    def profile_imports(self):
+        """Median self import time per top-level package, like -X importtime aggregated."""
+        runs = []
+        for _ in range(self.repeat):
+            _, _, stderr = self.probe(importtime=True)
+            totals = defaultdict(float)
+            for line in stderr.splitlines():
+                match = IMPORTTIME_LINE.match(line)
+                if match:
+                    self_us, module = match.groups()
+                    totals[module.split('.')[0]] += int(self_us) / 1000
+            runs.append(totals)
+
+        packages = set().union(*runs)
+        medians = {package: statistics.median(run.get(package, 0.0) for run in runs) for package in packages}
+        return dict(sorted(medians.items(), key=lambda item: -item[1]))
+
+    def profile_startup(self):
+        """Median time of each startup phase with no request served."""
+        runs = [self.probe() for _ in range(self.repeat)]
+        phases = {name: statistics.median(timings[name] for timings, _, _ in runs) for name in runs[0][0]}
+        phases['process_wall_ms'] = statistics.median(wall for _, wall, _ in runs)
+        return phases
+
+    def profile_urls(self, username):
+        """Median cold time to first response for every argument-free route in eventapp/urls.py."""
+        results = {}
+        for pattern in eventapp_urls.urlpatterns:
+            if pattern.pattern.converters or not pattern.name:
+                continue
+            path = reverse(pattern.name)
+            argv = [path] + ([username] if username else [])
+            runs = [self.probe(*argv) for _ in range(self.repeat)]
+            results[path] = {
+                'name': pattern.name,
+                'status': runs[-1][0]['status'],
+                'response_ms': statistics.median(timings['response_ms'] for timings, _, _ in runs),
+                'first_response_ms': statistics.median(timings['first_response_ms'] for timings, _, _ in runs),
+                'process_wall_ms': statistics.median(wall for _, wall, _ in runs),
+            }
+        return results
+
+    def report(self, results, top):
+        self.stdout.write(f"Import cost by package (median of {self.repeat}, self time):")
+        total = sum(results['imports_ms'].values())
+        for package, ms in list(results['imports_ms'].items())[:top]:
+            self.stdout.write(f"  {package:<28} {ms:8.1f} ms  {ms / total:6.1%}")
+        self.stdout.write(f"  {'all imports':<28} {total:8.1f} ms")
+
+        self.stdout.write("Startup phases:")
+        for phase, ms in results['startup_ms'].items():
+            self.stdout.write(f"  {phase:<28} {ms:8.1f}")
+
+        who = results['user'] or 'anonymous'
+        self.stdout.write(f"Time to first response ({who}):")
+        for path, timings in results['urls'].items():
+            self.stdout.write(
+                f"  {path:<20} {timings['status']}  first response {timings['first_response_ms']:7.1f} ms "
+                f"(request {timings['response_ms']:6.1f} ms, process {timings['process_wall_ms']:6.0f} ms)"
+            )
@@ -0,0 +1,103 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from eventapp.cache import invalidate_quizzes
+from eventapp.classification import CATEGORY_INDEX, weights_from_answers
+from eventapp.models import AttractionQuiz, PersonalityQuiz
+
+
+def attraction_vectors(answers):
+    # Preferences are simply the answers (see AttractionQuiz.calculate_preferences)
+    return np.asarray(answers)
+
+
+class Command(BaseCommand):
+    help = "Recompute weights and categories for every quiz (e.g. after CATEGORY_GROUPS changes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help="Rows fetched, classified and written per batch (default 2000)."
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Write every row back, not just the ones whose values changed."
+        )
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.write_all = options['all']
+
+        self.reclassify(
+            PersonalityQuiz, 'personality quizzes', 9,
+            weights_from_answers, 'calculated_weights', 'category_classification',
+        )
+        self.reclassify(
+            AttractionQuiz, 'attraction quizzes', 3,
+            attraction_vectors, 'preferences', 'most_attracted_category',
+        )
+
+    def reclassify(self, model, label, answer_count, vectors_for, vector_field, category_field):
+        """Stream every quiz of `model` in chunks, reclassify each chunk, and write back the changes."""
+        started = time.perf_counter()
+        seen = updated = 0
+
+        fields = ['id', 'user_id', 'answers', vector_field, *model.VECTOR_FIELDS, category_field]
+        queryset = model.objects.only(*fields).order_by('pk')
+        batch = []
+        for quiz in queryset.iterator(chunk_size=self.chunk_size):
+            batch.append(quiz)
+            if len(batch) == self.chunk_size:
+                updated += self.flush(batch, answer_count, vectors_for, vector_field, category_field)
+                seen += len(batch)
+                batch = []
+        if batch:
+            updated += self.flush(batch, answer_count, vectors_for, vector_field, category_field)
+            seen += len(batch)
+
+        elapsed = time.perf_counter() - started
+        rate = seen / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Reclassified {seen} {label} ({updated} changed) in {elapsed:.2f}s ({rate:,.0f} rows/s)."
+        ))
+
+    def flush(self, batch, answer_count, vectors_for, vector_field, category_field):
+        """Reclassify one chunk in a single vectorized call and write it back; returns rows written."""
+        complete = [quiz for quiz in batch if quiz.answers and len(quiz.answers) >= answer_count]
+        if not complete:
+            return 0
+
+        vectors = vectors_for([quiz.answers[:answer_count] for quiz in complete])
+        categories = CATEGORY_INDEX.classify_many(vectors)
+
+        model = type(batch[0])
+        columns = model.VECTOR_FIELDS
+
+        # Rows whose vector (JSON or float columns) changed need their own values
+        # written; rows where only the category moved can share one UPDATE per category
+        vector_changed = []
+        category_changed = defaultdict(list)
+        for quiz, vector, category in zip(complete, vectors.tolist(), categories):
+            stale = getattr(quiz, vector_field) != vector or [getattr(quiz, column) for column in columns] != vector
+            if self.write_all or stale:
+                setattr(quiz, vector_field, vector)
+                setattr(quiz, category_field, category)
+                quiz.sync_vector_columns()
+                vector_changed.append(quiz)
+            elif getattr(quiz, category_field) != category:
+                category_changed[category].append(quiz)
+
+        if vector_changed:
+            model.objects.bulk_update(
+                vector_changed, [vector_field, *columns, category_field], batch_size=self.chunk_size
+            )
+        for category, quizzes in category_changed.items():
+            model.objects.filter(pk__in=[quiz.pk for quiz in quizzes]).update(**{category_field: category})
+
+        # Bulk writes skip save(), so drop the affected cache entries here
+        changed = vector_changed + [quiz for quizzes in category_changed.values() for quiz in quizzes]
+        invalidate_quizzes(*[quiz.user_id for quiz in changed])
+        return len(changed)
@@ -1,80 +1,293 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from eventapp.models import PersonalityQuiz, MatchResult
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from eventapp import match_store
+from eventapp.assignment import TIME_LIMIT, pair_up
+from eventapp.matching import SCORERS, Buckets, Population, stream_tiles, stream_top_k, top_k
+from eventapp.models import Event
+
+# Least time between two progress lines while streaming
+PROGRESS_SECONDS = 2.0
+
+# Ranks and MatchGeneration.top_k are stored as small integers
+MAX_TOP_K = 32767
 
 
 class Command(BaseCommand):
-    help = "Compute top 3 matches for each user based on personality quiz answers."
+    help = (
+        "Compute top 3 matches for each user based on personality quiz answers (or mutual attraction), "
+        "site-wide or among the attendees of one or more events."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--event', action='append', default=[], metavar='SLUG',
+            help="Match only this event's attendees; repeat to match several events, each on its own."
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help="With several --event, how many events to match at the same time (default 1)."
+        )
+        parser.add_argument(
+            '--top-k', type=int, default=3,
+            help="How many matches to keep per user (default 3)."
+        )
+        parser.add_argument(
+            '--scoring', choices=sorted(SCORERS), default='personality',
+            help="'personality' compares personalities; 'mutual' scores two-sided attraction "
+                 "and only matches users who did both quizzes."
+        )
+        parser.add_argument(
+            '--assignment', action='store_true',
+            help="Pair everyone one-to-one to maximize the total score instead of giving each user a top-k list."
+        )
+        parser.add_argument(
+            '--candidates', type=int, default=10,
+            help="With --assignment, how many top candidates per user to consider (default 10)."
+        )
+        parser.add_argument(
+            '--time-limit', type=float, default=TIME_LIMIT,
+            help=f"With --assignment, seconds the solver may spend improving the pairing (default {TIME_LIMIT:g})."
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=None,
+            help="Rows scored per block; defaults to a size that keeps memory bounded."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Rows per bulk insert (default 5000)."
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Processes to score with; each takes shards of rows (default 1, no pool)."
+        )
+        parser.add_argument(
+            '--stream', action='store_true',
+            help="Score in fixed-size tiles and spill the lists to memory-mapped files, so memory "
+                 "stays within --memory-budget however many users there are."
+        )
+        parser.add_argument(
+            '--memory-budget', type=int, default=256,
+            help="With --stream, megabytes to spend on scoring at once (default 256)."
+        )
+        parser.add_argument(
+            '--spill-dir', default=None,
+            help="With --stream, where to put the memory-mapped lists (default: the system temp directory)."
+        )
 
     def handle(self, *args, **options):
-        User = get_user_model()
+        if not 1 <= options['top_k'] <= MAX_TOP_K:
+            raise CommandError(f"--top-k must be between 1 and {MAX_TOP_K}.")
+        if options['candidates'] < 1:
+            raise CommandError("--candidates must be at least 1.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if options['block_size'] is not None and options['block_size'] < 1:
+            raise CommandError("--block-size must be at least 1.")
+        if options['memory_budget'] < 1:
+            raise CommandError("--memory-budget must be at least 1.")
+        if options['stream'] and options['assignment']:
+            raise CommandError("--stream computes top-k lists; it can't be combined with --assignment.")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+        if options['stream'] and options['workers'] > 1:
+            raise CommandError("--stream scores in a single process; drop --workers or --stream.")
+        if options['time_limit'] <= 0:
+            raise CommandError("--time-limit must be positive.")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        slugs = list(dict.fromkeys(options['event']))
+        events = Event.objects.in_bulk(slugs, field_name='slug')
+        missing = [slug for slug in slugs if slug not in events]
+        if missing:
+            raise CommandError(f"No event with slug {', '.join(missing)}.")
 
-        quizzes = list(PersonalityQuiz.objects.select_related('user'))
+        # Output lines are prefixed per event when several are matched at once
+        self.output_lock = threading.Lock()
+        self.local = threading.local()
 
-        if len(quizzes) < 2:
-            self.stdout.write(self.style.WARNING(
-                "Not enough quiz responses (need at least 2 users). No matches computed."
-            ))
+        if len(slugs) < 2:
+            self.run(events[slugs[0]] if slugs else None, options)
             return
 
-        # Clear all existing match results (fresh recompute)
-        MatchResult.objects.all().delete()
-        self.stdout.write("Cleared existing MatchResult entries.")
-
-        # Build vectors: user_id -> list of answers
-        user_vectors = {}
-        for quiz in quizzes:
-            user_vectors[quiz.user_id] = [
-                quiz.q1_romantic,
-                quiz.q2_outgoing,
-                quiz.q3_deep_talks,
-                quiz.q4_planner,
-                quiz.q5_spontaneous,
-            ]
-
-        # For each user, compute similarity with everyone else
-        for quiz in quizzes:
-            user = quiz.user
-            user_vec = user_vectors[user.id]
-
-            scores = []
-
-            for other_quiz in quizzes:
-                other_user = other_quiz.user
-                if other_user.id == user.id:
-                    continue  # skip self
-
-                other_vec = user_vectors[other_user.id]
-
-                # Simple distance: sum of absolute differences
-                distance = sum(
-                    abs(a - b) for a, b in zip(user_vec, other_vec)
-                )
+        # Each event's run loads, scores and publishes only its own attendees and
+        # generations, so runs don't wait on each other except to write
+        def run_event(event):
+            self.local.prefix = f"[{event.slug}] "
+            try:
+                self.run(event, options)
+            finally:
+                connection.close()  # This thread's connection
+
+        with ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='run-matching') as pool:
+            # list() re-raises the first event's error here
+            list(pool.map(run_event, [events[slug] for slug in slugs]))
+
+    def say(self, message, style=None):
+        """Write a line, prefixed with the event being matched on this thread."""
+        line = getattr(self.local, 'prefix', '') + message
+        with self.output_lock:
+            self.stdout.write(style(line) if style else line)
+            self.stdout.flush()
+
+    def run(self, event, options):
+        """Match everyone (event None) or `event`'s attendees, and publish the result."""
+        started = time.perf_counter()
+
+        population = Population.load(options['scoring'], event=event)
+
+        if len(population) < 2:
+            self.say("Not enough quiz responses (need at least 2 users). No matches computed.", self.style.WARNING)
+            return
 
-                # Max possible distance per question is 4 (1..5), so:
-                max_distance = 4 * len(user_vec)
-                similarity = max_distance - distance  # higher = more similar
+        scope = f"for {event.name} " if event else ""
+        self.say(f"Loaded {len(population)} quizzes {scope}in {time.perf_counter() - started:.2f}s.")
 
-                scores.append((other_user, similarity))
+        if options['assignment']:
+            self.handle_assignment(population, event, options)
+        elif options['stream']:
+            self.handle_stream(population, event, options)
+        else:
+            self.handle_top_k(population, event, options)
 
-            # Sort by similarity (highest first)
-            scores.sort(key=lambda tup: tup[1], reverse=True)
+        self.say(f"Matching complete! ({time.perf_counter() - started:.2f}s total)", self.style.SUCCESS)
 
-            # Take top 3 matches
-            top_matches = scores[:3]
+    def handle_top_k(self, population, event, options):
+        scoring = options['scoring']
 
-            # Create MatchResult rows
-            for rank_index, (match_user, similarity) in enumerate(top_matches, start=1):
-                MatchResult.objects.create(
-                    user=user,
-                    match=match_user,
-                    score=similarity,
-                    rank=rank_index,
+        # Score everyone against everyone in NumPy blocks, once per distinct vector
+        scoring_started = time.perf_counter()
+        buckets = Buckets(population, with_preferences=scoring != 'personality')
+        self.say(f"{len(population)} users share {len(buckets)} distinct quiz vectors.")
+        indices, scores = top_k(
+            population,
+            k=options['top_k'],
+            scorer=SCORERS[scoring],
+            block_size=options['block_size'],
+            buckets=buckets,
+            workers=options['workers'],
+        )
+        self.say(f"Scored {len(population)} users in {time.perf_counter() - scoring_started:.2f}s.")
+
+        # Write the new generation in one transaction; readers switch over at commit
+        writing_started = time.perf_counter()
+        generation = match_store.publish(
+            population.user_ids.tolist(),
+            population.user_ids[indices].tolist(),
+            scores.tolist(),
+            scoring=scoring,
+            batch_size=options['batch_size'],
+            event=event,
+            top_k=options['top_k'],
+        )
+        self.say(
+            f"Wrote {generation.row_count} matches as generation {generation.pk} "
+            f"in {time.perf_counter() - writing_started:.2f}s."
+        )
+
+    def handle_stream(self, population, event, options):
+        scoring = options['scoring']
+        n = len(population)
+        k = max(0, min(options['top_k'], n - 1))
+        budget = options['memory_budget'] * 2**20
+        rows, columns = stream_tiles(n, budget)
+        self.say(
+            f"Streaming {n} users in tiles of {rows} x {columns} scores "
+            f"({options['memory_budget']} MB budget)."
+        )
+
+        with tempfile.TemporaryDirectory(dir=options['spill_dir']) as spill:
+            indices = np.lib.format.open_memmap(Path(spill) / 'indices.npy', mode='w+', dtype=np.int64, shape=(n, k))
+            scores = np.lib.format.open_memmap(Path(spill) / 'scores.npy', mode='w+', dtype=np.float64, shape=(n, k))
+
+            scoring_started = time.perf_counter()
+            last_report = scoring_started
+
+            def progress(done, cells):
+                nonlocal last_report
+                now = time.perf_counter()
+                if done < n and now - last_report < PROGRESS_SECONDS:
+                    return
+                last_report = now
+                elapsed = now - scoring_started
+                self.say(
+                    f"  {done}/{n} users ({done / n:.0%}), {cells / elapsed / 1e6:,.1f}M scores/s, "
+                    f"about {elapsed * (n - done) / done:.0f}s left"
                 )
 
-            self.stdout.write(
-                f"Computed {len(top_matches)} matches for {user.username}."
+            stream_top_k(population, indices, scores, scorer=SCORERS[scoring], budget_bytes=budget, progress=progress)
+            self.say(f"Scored {n} users in {time.perf_counter() - scoring_started:.2f}s.")
+
+            # Positions become user ids in place, a block at a time
+            for start in range(0, n, rows):
+                indices[start:start + rows] = population.user_ids[indices[start:start + rows]]
+
+            writing_started = time.perf_counter()
+            generation = match_store.publish(
+                population.user_ids,
+                indices,
+                scores,
+                scoring=scoring,
+                batch_size=options['batch_size'],
+                event=event,
+                top_k=options['top_k'],
+            )
+            self.say(
+                f"Wrote {generation.row_count} matches as generation {generation.pk} "
+                f"in {time.perf_counter() - writing_started:.2f}s."
             )
+            del indices, scores  # Close the maps before their files go
+
+    def handle_assignment(self, population, event, options):
+        scoring = options['scoring']
+
+        # Solve the one-to-one pairing over each user's top candidates
+        pairing_started = time.perf_counter()
+        pairing = pair_up(
+            population,
+            scorer=SCORERS[scoring],
+            k=options['candidates'],
+            block_size=options['block_size'],
+            workers=options['workers'],
+            time_limit=options['time_limit'],
+        )
+        self.say(
+            f"Paired {2 * len(pairing)} of {len(population)} users into {len(pairing)} pairs "
+            f"in {time.perf_counter() - pairing_started:.2f}s."
+        )
+        self.say(
+            f"Total score {pairing.objective:.4f}. Pairs among the top {options['candidates']} candidates score "
+            f"{pairing.candidate_objective:.4f}, at most {pairing.gap:.4f} below the best such pairing "
+            f"(bound {pairing.upper_bound:.4f}); the other {pairing.leftover_score:.4f} comes from pairing "
+            f"the users left over."
+        )
+
+        # Store each pair in both directions so both users see their match
+        user_ids = population.user_ids
+        firsts = user_ids[[a for a, b in pairing.pairs]].tolist()
+        seconds = user_ids[[b for a, b in pairing.pairs]].tolist()
+        pair_scores = [[score] for score in pairing.scores.tolist()]
 
-        self.stdout.write(self.style.SUCCESS("Matching complete!"))
+        writing_started = time.perf_counter()
+        generation = match_store.publish(
+            firsts + seconds,
+            [[match_id] for match_id in seconds + firsts],
+            pair_scores + pair_scores,
+            scoring=scoring,
+            one_to_one=True,
+            batch_size=options['batch_size'],
+            event=event,
+            top_k=1,
+        )
+        self.say(
+            f"Wrote {generation.row_count} matches as generation {generation.pk} "
+            f"in {time.perf_counter() - writing_started:.2f}s."
+        )
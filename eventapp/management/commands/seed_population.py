@@ -0,0 +1,107 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, get_hashers_by_algorithm, make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from eventapp import synthetic
+from eventapp.models import Event
+
+# Hashed once for every seeded attendee when the settings accept it (dev and bench)
+CHEAP_HASHER = 'md5'
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic attendees with both quizzes done, for benchmarks and event rehearsals. "
+        "The same --seed always creates the same people."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--attendees', type=int, default=1000,
+            help="How many attendees to create (default 1000)."
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Seed for the generated answers (default 0)."
+        )
+        parser.add_argument(
+            '--prefix', default='guest',
+            help="Usernames are <prefix>0, <prefix>1, ... (default 'guest')."
+        )
+        parser.add_argument(
+            '--password', default='attendee',
+            help="Password shared by every seeded attendee (default 'attendee'); '' disables login."
+        )
+        parser.add_argument(
+            '--replace', action='store_true',
+            help="Delete the users of an earlier seeding (--prefix and a number) first, instead of refusing to run."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Rows per batch of inserts (default 5000)."
+        )
+        parser.add_argument(
+            '--event', default=None, metavar='SLUG',
+            help="Make the attendees part of this event, creating it if it doesn't exist yet."
+        )
+        parser.add_argument(
+            '--match', action='store_true',
+            help="Run a full matching pass afterwards (for --event only, with --event)."
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['attendees'] < 1:
+            raise CommandError("--attendees must be at least 1.")
+        if not prefix:
+            raise CommandError("--prefix can't be empty.")
+
+        # Only names this command generates, so real users who happen to share the prefix are safe
+        existing = synthetic.seeded_users(prefix)
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError(
+                    f"There are already users named {prefix}0, {prefix}1, ...; pick another --prefix or pass --replace."
+                )
+            started = time.perf_counter()
+            deleted, _ = existing.delete()
+            self.stdout.write(f"Deleted {deleted} rows from an earlier seeding in {time.perf_counter() - started:.2f}s.")
+
+        # One hash for everybody, salted from the seed so reruns write identical rows
+        if not options['password']:
+            password = UNUSABLE_PASSWORD_PREFIX
+        elif CHEAP_HASHER in get_hashers_by_algorithm():
+            password = make_password(options['password'], salt=f"seed{options['seed']}", hasher=CHEAP_HASHER)
+        else:
+            password = make_password(options['password'], salt=f"seed{options['seed']}")
+            self.stdout.write(self.style.WARNING(
+                f"The {CHEAP_HASHER} hasher isn't enabled here, so every login by a seeded attendee "
+                f"pays for a full {settings.PASSWORD_HASHERS[0].rsplit('.', 1)[-1]} hash."
+            ))
+
+        event = None
+        if options['event']:
+            event, created = Event.objects.get_or_create(slug=options['event'], defaults={'name': options['event']})
+            if created:
+                self.stdout.write(f"Created the event {event.slug}.")
+
+        started = time.perf_counter()
+        user_ids = synthetic.create_attendees(
+            options['attendees'],
+            seed=options['seed'],
+            prefix=prefix,
+            password=password,
+            batch_size=options['batch_size'],
+            event=event,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(user_ids)} attendees ({prefix}0 to {prefix}{len(user_ids) - 1}) with both quizzes "
+            f"in {time.perf_counter() - started:.2f}s."
+        ))
+
+        if options['match']:
+            events = [event.slug] if event else []
+            call_command('run_matching', event=events, stdout=self.stdout, stderr=self.stderr)
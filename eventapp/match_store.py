@@ -0,0 +1,292 @@
+"""
+Versioned storage for match results.
+
+Every full matching run writes its rows under a brand new MatchGeneration and
+flips the active flag over to it in the same transaction, so readers keep
+seeing the previous generation until the new one is complete. Generations that
+are no longer active are pruned after commit, on a background thread unless
+the database is SQLite (see prune_after_commit).
+
+Generations belong either to the whole site or to one Event. Each event has
+its own active generation and its own history, so runs for different events
+never touch each other's rows and can go on at the same time.
+
+Single quiz submissions don't need a full run: update_user_matches scores the
+one user against everyone and patches the active generation in place.
+"""
+import threading
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import forget_active_generation, invalidate_matches
+from .matching import SCORERS, Population, score_row, select_top_k
+from .models import Event, MatchGeneration, MatchResult
+
+# How many generations (including the active one) to keep around after a swap
+KEEP_GENERATIONS = 2
+
+
+def active_generation(event=None):
+    """The generation readers currently see (site-wide, or `event`'s), or None before the first run."""
+    return MatchGeneration.objects.filter(is_active=True, event=event).first()
+
+
+def activate(generation):
+    """
+    Make `generation` the one readers see, in place of the active generation
+    of the same event (or the site-wide one). Must run inside a transaction.
+    """
+    (
+        MatchGeneration.objects.filter(is_active=True, event_id=generation.event_id)
+        .exclude(pk=generation.pk)
+        .update(is_active=False)
+    )
+    generation.is_active = True
+    generation.activated_at = timezone.now()
+    generation.save(update_fields=['is_active', 'activated_at'])
+
+    # Cached match lists are keyed by generation; only the pointer needs to move
+    transaction.on_commit(lambda: forget_active_generation(generation.event_id))
+
+
+def publish(user_ids, match_ids, scores, scoring='personality', one_to_one=False, batch_size=5000, prune=True,
+            event=None, top_k=None):
+    """
+    Store a full set of top-k lists as a new generation, site-wide or for
+    `event`, and swap it in.
+
+    `user_ids` is shaped (n,), `match_ids` and `scores` are shaped (n, k) and
+    already sorted best first; lists and NumPy arrays (memory-mapped ones
+    included) both work. `top_k` is the k that was asked for (lists are
+    shorter when there are fewer users); it defaults to the longest list.
+    Everything happens in one transaction: the rows are
+    built and bulk inserted `batch_size` owners at a time, and the new
+    generation is activated before commit.
+    """
+    lengths = [len(matches) for matches in match_ids]
+    with transaction.atomic():
+        generation = MatchGeneration.objects.create(
+            event=event,
+            scoring=scoring,
+            one_to_one=one_to_one,
+            top_k=top_k if top_k is not None else max(lengths, default=0),
+            row_count=sum(lengths),
+        )
+        for start in range(0, len(user_ids), batch_size):
+            chunk = [_as_list(values[start:start + batch_size]) for values in (user_ids, match_ids, scores)]
+            rows = [
+                MatchResult(generation=generation, user_id=user_id, match_id=match_id, score=score, rank=rank_index)
+                for user_id, matches, match_scores in zip(*chunk)
+                for rank_index, (match_id, score) in enumerate(zip(matches, match_scores), start=1)
+            ]
+            MatchResult.objects.bulk_create(rows, batch_size=batch_size)
+        activate(generation)
+
+        if prune:
+            transaction.on_commit(lambda: prune_after_commit(event=event))
+
+    return generation
+
+
+def _as_list(values):
+    """Plain Python values, which every database driver accepts."""
+    return values.tolist() if isinstance(values, np.ndarray) else values
+
+
+def prune_generations(keep=KEEP_GENERATIONS, event=None):
+    """
+    Delete every inactive generation except the newest `keep - 1` of them,
+    among the site-wide generations or `event`'s.
+    """
+    stale = list(
+        MatchGeneration.objects.filter(is_active=False, event=event)
+        .order_by('-id')
+        .values_list('id', flat=True)[max(keep - 1, 0):]
+    )
+    if not stale:
+        return 0
+
+    # Delete the results directly so the ORM doesn't collect them one by one
+    MatchResult.objects.filter(generation_id__in=stale).delete()
+    MatchGeneration.objects.filter(id__in=stale).delete()
+    return len(stale)
+
+
+def prune_after_commit(keep=KEEP_GENERATIONS, event=None):
+    """
+    Prune on a background thread, or right here on SQLite: it has a single
+    writer, so a pruning thread would lock out the caller's next write.
+    """
+    if connection.vendor == 'sqlite':
+        prune_generations(keep, event)
+    else:
+        prune_in_background(keep, event)
+
+
+def prune_in_background(keep=KEEP_GENERATIONS, event=None):
+    """Run prune_generations on its own thread and database connection."""
+    def run():
+        try:
+            prune_generations(keep, event)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='match-generation-pruner')
+    thread.start()
+    return thread
+
+
+def update_user_matches(user_id, k=None, event=None):
+    """
+    Patch the active generation (site-wide, or `event`'s) after `user_id`
+    submits or changes a quiz. Lists keep the generation's top_k unless `k`
+    says otherwise.
+
+    Only that user's row of scores is computed, so the cost is O(n) instead of
+    the O(n^2) of a full run. The user gets a fresh top-k list, and everyone
+    else's list is only rewritten if the user now belongs in it (or used to be
+    in it). Scores use the same mode as the active generation. A user who is
+    no longer in the population (removed from the event, or without a
+    complete quiz) loses their own list and leaves everyone else's. Returns
+    the number of lists that were rewritten.
+
+    One-to-one pairings can't be patched locally without breaking somebody
+    else's pair, so those generations are left alone until the next full run.
+    """
+    with transaction.atomic():
+        # Lock the active generation so concurrent submissions patch it one at a time
+        generation = MatchGeneration.objects.select_for_update().filter(is_active=True, event=event).first()
+        if generation is None:
+            generation = MatchGeneration(event=event)
+            if k is not None:
+                generation.top_k = k
+            generation.save()
+            activate(generation)
+        if generation.one_to_one:
+            return 0
+
+        scorer = SCORERS[generation.scoring]
+        population = Population.load(generation.scoring, event=event)
+        n = len(population)
+        k = max(0, min(generation.top_k if k is None else k, n - 1))
+
+        position = population.position(user_id)
+        if position is None:
+            return _drop_user(generation, population, scorer, user_id, k)
+
+        row = score_row(population, position, scorer)
+
+        # Existing lists as parallel arrays of positions, ordered by owner then rank
+        stored = np.array(
+            MatchResult.objects.filter(generation=generation)
+            .order_by('user_id', 'rank')
+            .values_list('user_id', 'match_id', 'score'),
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        owners, matches, scores = _positions(population, stored)
+
+        counts = np.bincount(owners, minlength=n)
+        # Each owner's worst (last ranked) entry; -inf for owners with no list
+        worst_score = np.full(n, -np.inf)
+        worst_match = np.full(n, n, dtype=np.int64)
+        last = np.flatnonzero(np.append(owners[1:] != owners[:-1], True)) if len(owners) else []
+        worst_score[owners[last]] = scores[last]
+        worst_match[owners[last]] = matches[last]
+
+        # Who already has this user in their list, and with what score
+        listed = matches == position
+        old_score = np.full(n, np.nan)
+        old_score[owners[listed]] = scores[listed]
+
+        # Lists the user now breaks into (ties go to the lower position)
+        beats = (row > worst_score) | ((row == worst_score) & (position < worst_match)) | (counts < k)
+        # Lists that must be rebuilt from scratch: the user dropped in score there
+        # and might fall out, or the list was short before this user arrived
+        rebuild = (row < old_score) | (counts < min(k, n - 2))
+        affected = beats | ~np.isnan(old_score)
+        affected[position] = False
+
+        lists = {position: select_top_k(row[None, :], k)}
+        for other in np.flatnonzero(affected).tolist():
+            if rebuild[other]:
+                lists[other] = select_top_k(score_row(population, other, scorer)[None, :], k)
+                continue
+            # Merge the user into the existing list
+            keep = (owners == other) & ~listed
+            candidates = np.append(matches[keep], position)
+            candidate_scores = np.append(scores[keep], row[other])
+            order = np.lexsort((candidates, -candidate_scores))[:k]
+            lists[other] = (candidates[order][None, :], candidate_scores[order][None, :])
+
+        _replace_lists(generation, population, lists)
+
+    return len(lists)
+
+
+def _drop_user(generation, population, scorer, user_id, k):
+    """
+    Remove `user_id`, who isn't in `population`, from `generation`: delete
+    their list and rebuild every list they appear in. Owners who left the
+    population as well just lose their lists.
+    """
+    listed_by = set(MatchResult.objects.filter(generation=generation, match_id=user_id).values_list('user_id', flat=True))
+    lists = {}
+    gone = [user_id]
+    for owner_id in sorted(listed_by):
+        other = population.position(owner_id)
+        if other is None:
+            gone.append(owner_id)
+        else:
+            lists[other] = select_top_k(score_row(population, other, scorer)[None, :], k)
+    _replace_lists(generation, population, lists, gone)
+    return len(lists)
+
+
+def _replace_lists(generation, population, lists, gone=()):
+    """
+    Swap the rewritten `lists` ({position: (indices, scores)}) into
+    `generation` in place, and delete the lists of the user ids in `gone`.
+    """
+    owner_ids = population.user_ids[list(lists)].tolist()
+    removed, _ = MatchResult.objects.filter(generation=generation, user_id__in=[*owner_ids, *gone]).delete()
+    rows = [
+        MatchResult(generation=generation, user_id=owner_id, match_id=match_id, score=score, rank=rank_index)
+        for owner_id, (indices, list_scores) in zip(owner_ids, lists.values())
+        for rank_index, (match_id, score) in enumerate(
+            zip(population.user_ids[indices[0]].tolist(), list_scores[0].tolist()), start=1
+        )
+    ]
+    MatchResult.objects.bulk_create(rows)
+    MatchGeneration.objects.filter(pk=generation.pk).update(row_count=F('row_count') + len(rows) - removed)
+    transaction.on_commit(lambda: invalidate_matches(generation.pk, *owner_ids, *gone))
+
+
+def update_user_everywhere(user_id, k=None):
+    """
+    update_user_matches for the site-wide generation and for every event
+    `user_id` attends, or has a list in (so leaving an event takes them out
+    of it). Returns the total number of lists rewritten.
+    """
+    rewritten = update_user_matches(user_id, k)
+    listed_in = Event.objects.filter(generations__is_active=True, generations__results__user_id=user_id)
+    for event in (Event.objects.filter(attendees=user_id) | listed_in).distinct():
+        rewritten += update_user_matches(user_id, k, event=event)
+    return rewritten
+
+
+def _positions(population, stored):
+    """Turn stored (user_id, match_id, score) rows into population positions."""
+    owners = np.searchsorted(population.user_ids, stored[:, 0].astype(np.int64))
+    matches = np.searchsorted(population.user_ids, stored[:, 1].astype(np.int64))
+
+    # Drop rows that mention users who are no longer in the population
+    owners_clipped = np.minimum(owners, len(population) - 1)
+    matches_clipped = np.minimum(matches, len(population) - 1)
+    present = (
+        (population.user_ids[owners_clipped] == stored[:, 0])
+        & (population.user_ids[matches_clipped] == stored[:, 1])
+    )
+    return owners[present], matches[present], stored[present, 2]
@@ -0,0 +1,387 @@
+"""
+Vectorized matching engine.
+
+Every matchable user's quiz vector is loaded into one NumPy matrix and scored
+against the whole population a block of rows at a time, so memory stays
+bounded no matter how big the event is. The best k candidates for each row
+are picked with argpartition instead of sorting the full row.
+
+Answers are 1-5 Likert values and weights are rounded to two decimals, so a
+big crowd has far fewer distinct vectors than people. top_k groups users
+with identical vectors into Buckets, scores bucket against bucket, and
+expands the bucket results back into exactly the per-user lists the plain
+user-by-user pass would produce.
+
+For populations too big for even one full row block, stream_top_k walks
+fixed-size tiles of rows and columns, keeps a running top-k per row, and
+writes the lists to memory-mapped files, so scoring memory depends on the
+budget rather than on n.
+"""
+import numpy as np
+
+from .models import AttractionQuiz, PersonalityQuiz
+
+# Largest possible Euclidean distance between two vectors of three 1-5 values
+MAX_DISTANCE = 4.0 * np.sqrt(3)
+
+# How many score cells (rows x population) to compute per block
+BLOCK_CELLS = 4_000_000
+
+# Rough bytes per score cell while scoring a tile: the scorers hold several
+# float64 temporaries of the tile's shape at once (mutual scoring the most)
+CELL_BYTES = 64
+
+# Most rows streamed per block; more columns per tile suit the matrix products better
+STREAM_ROWS = 1024
+
+# Score bucket by bucket only when there are at most this many buckets per user;
+# near one bucket per user the grouping is pure overhead
+MAX_BUCKET_SHARE = 0.9
+
+
+class Population:
+    """Quiz vectors for every matchable user, ordered by user id."""
+
+    def __init__(self, user_ids, weights, preferences=None):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64).reshape(-1, 3)
+        self.preferences = None
+        if preferences is not None:
+            self.preferences = np.asarray(preferences, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def position(self, user_id):
+        """Row of `user_id` in the population, or None if they can't be matched yet."""
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return position
+        return None
+
+    @classmethod
+    def load(cls, scoring='personality', event=None):
+        """
+        Load the calculated weights of every completed personality quiz, or
+        only those of `event`'s attendees.
+
+        Mutual scoring also needs attraction preferences, so it only loads
+        users who have completed both quizzes. Vectors come straight from the
+        float columns, so no JSON is parsed.
+        """
+        quizzes = PersonalityQuiz.objects.filter(social_weight__isnull=False)
+        if event is not None:
+            # Starts from the event's attendee rows, so loading costs the size of the event
+            quizzes = quizzes.filter(user__events=event)
+        if scoring != 'mutual':
+            rows = quizzes.order_by('user_id').values_list('user_id', *PersonalityQuiz.VECTOR_FIELDS)
+            table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+            return cls(table[:, 0], table[:, 1:])
+
+        # Join through the user so both vectors arrive in one query
+        rows = (
+            quizzes.filter(user__attraction_quiz__social_preference__isnull=False)
+            .order_by('user_id')
+            .values_list(
+                'user_id',
+                *PersonalityQuiz.VECTOR_FIELDS,
+                *[f'user__attraction_quiz__{field}' for field in AttractionQuiz.VECTOR_FIELDS],
+            )
+        )
+        table = np.array(rows, dtype=np.float64).reshape(-1, 7)
+        return cls(table[:, 0], table[:, 1:4], table[:, 4:])
+
+
+def closeness(a, b):
+    """
+    Similarity between every row of `a` and every row of `b`, from 1 (identical)
+    down to 0 (opposite corners of the 1-5 cube).
+
+    Squared distances are expanded as |a|^2 + |b|^2 - 2ab so the whole block is
+    a single matrix product.
+    """
+    squared = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * (a @ b.T)
+    # Quiz vectors carry at most two decimals, so exact squared distances are
+    # multiples of 0.0001. Rounding strips the float noise from the expansion so
+    # equal distances tie exactly and identical vectors score exactly 1.
+    np.round(squared, 6, out=squared)
+    np.maximum(squared, 0.0, out=squared)
+    return 1.0 - np.sqrt(squared) / MAX_DISTANCE
+
+
+def personality_scores(population, start, stop, columns=slice(None)):
+    """Score rows start:stop against everyone (or `columns`) by how alike their personalities are."""
+    return closeness(population.weights[start:stop], population.weights[columns])
+
+
+def mutual_scores(population, start, stop, columns=slice(None)):
+    """
+    Score rows start:stop against everyone (or `columns`) by mutual attraction.
+
+    For A and B this is how close A's preferences are to B's personality and
+    how close B's preferences are to A's, combined with a geometric mean so a
+    one-sided attraction scores low. Each side is one preference-by-weight
+    matrix product over the whole population.
+    """
+    they_suit_me = closeness(population.preferences[start:stop], population.weights[columns])
+    i_suit_them = closeness(population.weights[start:stop], population.preferences[columns])
+    return np.sqrt(they_suit_me * i_suit_them)
+
+
+# Scoring modes selectable from run_matching --scoring
+SCORERS = {
+    'personality': personality_scores,
+    'mutual': mutual_scores,
+}
+
+
+def select_top_k(block, k):
+    """
+    Pick the k highest scores in each row of `block`.
+
+    Ties are broken by the lower column index so results do not depend on how
+    argpartition happens to order equal values. Returns (indices, scores), both
+    shaped (rows, k) and sorted best first.
+    """
+    rows, n = block.shape
+    if k == 0:
+        return np.empty((rows, 0), dtype=np.int64), np.empty((rows, 0))
+
+    # The k-th largest value in each row is the cut-off for that row
+    kth = np.partition(block, n - k, axis=1)[:, n - k]
+    above = block > kth[:, None]
+    tied = block == kth[:, None]
+
+    # Fill the remaining slots with the lowest-index columns tied at the cut-off
+    needed = k - above.sum(axis=1)
+    chosen = above | (tied & (np.cumsum(tied, axis=1) <= needed[:, None]))
+
+    indices = np.nonzero(chosen)[1].reshape(rows, k)
+    scores = np.take_along_axis(block, indices, axis=1)
+
+    # Order the k winners best first, lower index first on ties
+    order = np.lexsort((indices, -scores), axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def score_row(population, position, scorer=personality_scores):
+    """
+    One user's scores against everyone else, with their own column set to -inf.
+
+    Every scorer is symmetric, so this row doubles as everyone's score against
+    that user.
+    """
+    row = scorer(population, position, position + 1)[0]
+    row[position] = -np.inf
+    return row
+
+
+class Buckets:
+    """
+    Users grouped by identical vectors: weights, plus preferences when the
+    scorer uses them too (mutual scoring).
+    """
+
+    def __init__(self, population, with_preferences=True):
+        with_preferences = with_preferences and population.preferences is not None
+        keys = population.weights
+        if with_preferences:
+            keys = np.hstack([population.weights, population.preferences])
+        vectors, of_user, self.sizes = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+
+        # Bucket of every user, and one stand-in user per bucket to score with
+        self.of_user = of_user.reshape(-1)
+        self.representatives = Population(
+            np.arange(len(vectors)),
+            vectors[:, :3],
+            vectors[:, 3:] if with_preferences else None,
+        )
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def first_members(self, count):
+        """
+        The `count` lowest positions in each bucket, shaped (buckets, count)
+        and padded with -1 where a bucket is smaller.
+        """
+        by_bucket = np.argsort(self.of_user, kind='stable')  # Positions stay ascending within a bucket
+        starts = np.cumsum(self.sizes) - self.sizes
+        members = np.full((len(self), count), -1, dtype=np.int64)
+        for offset in range(count):
+            present = self.sizes > offset
+            members[present, offset] = by_bucket[starts[present] + offset]
+        return members
+
+
+def user_rows_top_k(population, start, stop, k, scorer=personality_scores, block_size=None):
+    """The top-k lists of users start:stop, scored against everyone a block of rows at a time."""
+    n = len(population)
+    block_size = block_size or max(1, BLOCK_CELLS // max(n, 1))
+
+    indices = np.empty((stop - start, k), dtype=np.int64)
+    scores = np.empty((stop - start, k), dtype=np.float64)
+
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        block = scorer(population, block_start, block_stop)
+
+        # Never match anyone with themselves
+        rows = np.arange(block_stop - block_start)
+        block[rows, rows + block_start] = -np.inf
+
+        indices[block_start - start:block_stop - start], scores[block_start - start:block_stop - start] = (
+            select_top_k(block, k)
+        )
+
+    return indices, scores
+
+
+def bucket_rows_top_k(representatives, members, start, stop, scorer=personality_scores, block_size=None):
+    """
+    The best members.shape[1] users (best score, then lowest position) for
+    buckets start:stop, given each bucket's stand-in and lowest positions
+    (Buckets.representatives and Buckets.first_members).
+
+    Only buckets scoring at least as well as a bucket's width-th best bucket
+    can hold its best users, and from each only its `width` lowest positions.
+    """
+    b, width = members.shape
+    block_size = block_size or max(1, BLOCK_CELLS // max(b, 1))
+
+    best = np.empty((stop - start, width), dtype=np.int64)
+    best_scores = np.empty((stop - start, width), dtype=np.float64)
+
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        block = scorer(representatives, block_start, block_stop)
+
+        # Every bucket holds at least one user, so the width-th best bucket
+        # score is a floor for the width-th best user score
+        floor = np.partition(block, b - min(width, b), axis=1)[:, b - min(width, b)]
+        rows, candidates = np.nonzero(block >= floor[:, None])
+
+        # Each candidate bucket contributes its lowest positions
+        rows = np.repeat(rows, width)
+        positions = members[candidates].reshape(-1)
+        scores = np.repeat(block[rows[::width], candidates], width)
+        present = positions >= 0
+        rows, positions, scores = rows[present], positions[present], scores[present]
+
+        # Per bucket: best score first, then lowest position; keep the first `width`
+        order = np.lexsort((positions, -scores, rows))
+        rows, positions, scores = rows[order], positions[order], scores[order]
+        first = np.searchsorted(rows, np.arange(block_stop - block_start))
+        keep = np.arange(len(rows)) - first[rows] < width
+        best[block_start - start:block_stop - start] = positions[keep].reshape(-1, width)
+        best_scores[block_start - start:block_stop - start] = scores[keep].reshape(-1, width)
+
+    return best, best_scores
+
+
+def bucket_top_k(population, buckets, k, scorer=personality_scores, block_size=None, workers=1):
+    """
+    top_k computed between buckets instead of users.
+
+    Everyone in a bucket has the same scores, so for each bucket it is enough
+    to find the best k + 1 users overall and for each member to drop
+    themselves from that list.
+    """
+    n, b = len(population), len(buckets)
+    members = buckets.first_members(k + 1)
+
+    if workers > 1:
+        from .parallel import sharded_top_k
+        best, best_scores = sharded_top_k(buckets.representatives, k + 1, scorer, workers, block_size, members)
+    else:
+        best, best_scores = bucket_rows_top_k(buckets.representatives, members, 0, b, scorer, block_size)
+
+    # Each user takes their bucket's list without themselves
+    lists = best[buckets.of_user]
+    list_scores = best_scores[buckets.of_user]
+    is_self = lists == np.arange(n)[:, None]
+    order = np.argsort(is_self, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(lists, order, axis=1), np.take_along_axis(list_scores, order, axis=1)
+
+
+def top_k(population, k=3, scorer=personality_scores, block_size=None, buckets=None, workers=1):
+    """
+    Compute the top-k matches for every user in the population.
+
+    Returns (indices, scores) shaped (n, k) where indices point back into
+    population.user_ids. k is capped at n - 1 since nobody matches themselves.
+    Users with identical vectors are scored once per bucket when that saves
+    enough work; pass `buckets` if they're already grouped. With `workers`
+    above 1 the rows are split into shards scored by a process pool, with
+    the same result.
+    """
+    n = len(population)
+    k = max(0, min(k, n - 1))
+
+    if n and k:
+        # Personality scores ignore preferences, so they don't split buckets
+        buckets = buckets or Buckets(population, with_preferences=scorer is not personality_scores)
+        if len(buckets) <= MAX_BUCKET_SHARE * n:
+            return bucket_top_k(population, buckets, k, scorer, block_size, workers)
+
+    if workers > 1 and n and k:
+        from .parallel import sharded_top_k
+        return sharded_top_k(population, k, scorer, workers, block_size)
+    return user_rows_top_k(population, 0, n, k, scorer, block_size)
+
+
+def merge_top_k(indices, scores, more_indices, more_scores, k):
+    """
+    Merge two sets of per-row candidates into the best k, best score first
+    and lower index first on ties, like select_top_k.
+    """
+    indices = np.hstack([indices, more_indices])
+    scores = np.hstack([scores, more_scores])
+    order = np.lexsort((indices, -scores), axis=1)[:, :k]
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def stream_tiles(n, budget_bytes):
+    """(rows per block, columns per tile) whose scoring fits in `budget_bytes`."""
+    cells = max(1, budget_bytes // CELL_BYTES)
+    rows = max(1, min(n, STREAM_ROWS, cells))
+    return rows, max(1, min(n, cells // rows))
+
+
+def stream_top_k(population, indices, scores, scorer=personality_scores, budget_bytes=256 * 2**20, progress=None):
+    """
+    top_k for populations too big to score a full row block at once.
+
+    Rows are walked in blocks and columns in tiles, both sized from
+    `budget_bytes`; each tile's best k are merged into the block's running
+    top-k, and finished blocks go straight into `indices` and `scores`
+    (shaped (n, k) with k at most n - 1, usually memory-mapped files).
+    Results match top_k exactly. progress(rows_done, cells_scored) is called after every block.
+    """
+    n = len(population)
+    k = indices.shape[1]
+    rows, columns = stream_tiles(n, budget_bytes)
+    cells = 0
+
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        best = np.full((stop - start, k), n, dtype=np.int64)
+        best_scores = np.full((stop - start, k), -np.inf)
+
+        for column in range(0, n, columns):
+            column_stop = min(column + columns, n)
+            tile = scorer(population, start, stop, slice(column, column_stop))
+
+            # Never match anyone with themselves
+            own = np.arange(max(start, column), min(stop, column_stop))
+            tile[own - start, own - column] = -np.inf
+
+            tile_indices, tile_scores = select_top_k(tile, min(k, column_stop - column))
+            best, best_scores = merge_top_k(best, best_scores, tile_indices + column, tile_scores, k)
+            cells += tile.size
+
+        indices[start:stop], scores[start:stop] = best, best_scores
+        if progress is not None:
+            progress(stop, cells)
+
+    return indices, scores
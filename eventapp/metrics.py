@@ -0,0 +1,341 @@
+"""
+Request-level performance metrics, exposed in Prometheus text format at /metrics.
+
+MetricsMiddleware times every request and, through a database execute
+wrapper, counts the queries it ran and the time they took. Template render
+time comes from InstrumentedTemplates (the TEMPLATES backend), and cache.py
+reports hits and misses for each of its caches.
+
+Everything is kept in memory per process. With several workers each one
+serves its own numbers, so scrape every worker (or sum them) rather than a
+single one behind the load balancer. The background matching gauges are the
+exception: they are read from the job table, so every process reports the
+same values.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+# Upper bounds (seconds) for request, query and render time histograms
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds for the number of queries one request runs
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# View label for requests that didn't resolve to a view, so 404 scans can't
+# create a label per path
+UNMATCHED = '<unmatched>'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_number(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def values(self):
+        """{labels: value} for every label set seen so far."""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        for labels, value in sorted(self.values().items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_number(value)}'
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{format_number(bound)}"'
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {format_number(total)}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}'
+
+
+class Gauge:
+    """A value worked out when /metrics is scraped."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect  # returns {labels: value}
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_number(value)}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'matchsite_requests_total', "Requests served, by view, method and status code.",
+    labels=('view', 'method', 'status'),
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'matchsite_request_duration_seconds',
+    "Time from the request reaching the middleware to the response leaving it "
+    "(headers only for streaming responses).",
+    labels=('view', 'method'),
+))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    'matchsite_request_db_queries', "Database queries run per request.",
+    labels=('view',), buckets=QUERY_BUCKETS,
+))
+REQUEST_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'matchsite_request_db_duration_seconds', "Total database query time per request.",
+    labels=('view',),
+))
+TEMPLATE_SECONDS = REGISTRY.register(Histogram(
+    'matchsite_template_render_seconds', "Time to render a template, including what it extends and includes.",
+    labels=('template',),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'matchsite_cache_lookups_total', "Lookups in the app's caches (see eventapp/cache.py), by result.",
+    labels=('cache', 'result'),
+))
+
+
+def cache_hit_ratio():
+    values = CACHE_LOOKUPS.values()
+    ratios = {}
+    for name in {name for name, _ in values}:
+        hits, misses = values.get((name, 'hit'), 0), values.get((name, 'miss'), 0)
+        ratios[(name,)] = hits / (hits + misses) if hits + misses else 0.0
+    return ratios
+
+
+REGISTRY.register(Gauge(
+    'matchsite_cache_hit_ratio', "Hits over all lookups for each of the app's caches since the process started.",
+    labels=('cache',), collect=cache_hit_ratio,
+))
+
+
+# Background matching (see scheduler.py), read from the database at scrape
+# time. The models import this module, so scheduler.py is imported late.
+
+def match_jobs():
+    from .scheduler import job_counts
+    return {(state,): count for state, count in job_counts().items()}
+
+
+def match_queue_depth():
+    from .scheduler import job_counts
+    return {(): job_counts()['queued']}
+
+
+def match_queue_age():
+    from .scheduler import oldest_queued_seconds
+    return {(): oldest_queued_seconds()}
+
+
+def match_last_run():
+    from .scheduler import last_runs
+    return {(kind,): job.duration or 0.0 for kind, job in last_runs().items()}
+
+
+REGISTRY.register(Gauge(
+    'matchsite_match_queue_depth', "Matching jobs queued and waiting for match_worker.",
+    labels=(), collect=match_queue_depth,
+))
+REGISTRY.register(Gauge(
+    'matchsite_match_jobs', "Matching jobs in the job table, by state.",
+    labels=('state',), collect=match_jobs,
+))
+REGISTRY.register(Gauge(
+    'matchsite_match_queue_age_seconds', "How long the longest-waiting queued matching job has been queued.",
+    labels=(), collect=match_queue_age,
+))
+REGISTRY.register(Gauge(
+    'matchsite_match_last_run_duration_seconds', "Duration of the latest finished matching job, by kind.",
+    labels=('kind',), collect=match_last_run,
+))
+
+
+def cache_lookup(name, hits=0, misses=0):
+    """Record cache results; called by the helpers in cache.py."""
+    if hits:
+        CACHE_LOOKUPS.inc(name, 'hit', amount=hits)
+    if misses:
+        CACHE_LOOKUPS.inc(name, 'miss', amount=misses)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+# The stats of the request being served. Context variables follow a request
+# into sync_to_async threads, so queries from async views are counted too
+CURRENT = ContextVar('matchsite_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper installed on every connection."""
+    stats = CURRENT.get()
+    if stats is None:
+        return execute(sql, params, many, context)  # Background threads, commands
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_wrapper, dispatch_uid='matchsite_metrics')
+
+
+class MetricsMiddleware:
+    """Times each request and counts its queries. Goes first in MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            CURRENT.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            CURRENT.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    def start(self):
+        stats = RequestStats()
+        return stats, CURRENT.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNMATCHED
+        REQUESTS.inc(view, request.method, str(response.status_code))
+        REQUEST_SECONDS.observe(elapsed, view, request.method)
+        REQUEST_QUERIES.observe(stats.queries, view)
+        REQUEST_QUERY_SECONDS.observe(stats.query_seconds, view)
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            TEMPLATE_SECONDS.observe(time.perf_counter() - started, self.template.name or '<string>')
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """The Django template backend, timing every render."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def adopt_existing_results(apps, schema_editor):
+    """Put matches computed before generations existed into an active generation."""
+    MatchGeneration = apps.get_model('eventapp', 'MatchGeneration')
+    MatchResult = apps.get_model('eventapp', 'MatchResult')
+    row_count = MatchResult.objects.count()
+    if row_count:
+        generation = MatchGeneration.objects.create(
+            is_active=True, row_count=row_count, activated_at=timezone.now()
+        )
+        MatchResult.objects.update(generation=generation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0006_matchresult'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_active', models.BooleanField(default=False)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-id'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='single_active_match_generation')],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='matchresult',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='matchresult',
+            name='generation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='eventapp.matchgeneration'),
+        ),
+        migrations.RunPython(adopt_existing_results, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='matchresult',
+            name='generation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='eventapp.matchgeneration'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='matchresult',
+            unique_together={('generation', 'user', 'rank')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0007_match_generations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchgeneration',
+            name='scoring',
+            field=models.CharField(choices=[('personality', 'Personality similarity'), ('mutual', 'Mutual attraction')], default='personality', help_text='How the matches in this generation were scored', max_length=20),
+        ),
+    ]
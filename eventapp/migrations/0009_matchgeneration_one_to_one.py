@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0008_matchgeneration_scoring'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchgeneration',
+            name='one_to_one',
+            field=models.BooleanField(default=False, help_text='Each user has exactly one match from a global pairing instead of a top-k list'),
+        ),
+    ]
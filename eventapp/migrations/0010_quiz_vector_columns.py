@@ -0,0 +1,85 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:03
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast
+
+
+def backfill(model, json_field, columns):
+    """Copy every complete JSON vector into its float columns with one UPDATE."""
+    model.objects.filter(**{f'{json_field}__2__isnull': False}).update(**{
+        column: Cast(KT(f'{json_field}__{i}'), models.FloatField())
+        for i, column in enumerate(columns)
+    })
+
+
+def backfill_vector_columns(apps, schema_editor):
+    backfill(
+        apps.get_model('eventapp', 'PersonalityQuiz'), 'calculated_weights',
+        ['social_weight', 'genre_weight', 'romantic_weight'],
+    )
+    backfill(
+        apps.get_model('eventapp', 'AttractionQuiz'), 'preferences',
+        ['social_preference', 'genre_preference', 'romantic_preference'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0009_matchgeneration_one_to_one'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attractionquiz',
+            name='genre_preference',
+            field=models.FloatField(blank=True, help_text='preferences[1]: Books (1) -> Movies (5)', null=True),
+        ),
+        migrations.AddField(
+            model_name='attractionquiz',
+            name='romantic_preference',
+            field=models.FloatField(blank=True, help_text='preferences[2]: Less (1) -> More Romantic (5)', null=True),
+        ),
+        migrations.AddField(
+            model_name='attractionquiz',
+            name='social_preference',
+            field=models.FloatField(blank=True, help_text='preferences[0]: AntiSocial (1) -> Social (5)', null=True),
+        ),
+        migrations.AddField(
+            model_name='personalityquiz',
+            name='genre_weight',
+            field=models.FloatField(blank=True, help_text='calculated_weights[1]: Books (1) -> Movies (5)', null=True),
+        ),
+        migrations.AddField(
+            model_name='personalityquiz',
+            name='romantic_weight',
+            field=models.FloatField(blank=True, help_text='calculated_weights[2]: Less (1) -> More Romantic (5)', null=True),
+        ),
+        migrations.AddField(
+            model_name='personalityquiz',
+            name='social_weight',
+            field=models.FloatField(blank=True, help_text='calculated_weights[0]: AntiSocial (1) -> Social (5)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='attractionquiz',
+            name='most_attracted_category',
+            field=models.CharField(blank=True, db_index=True, help_text="The personality category (color) they're most attracted to", max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='personalityquiz',
+            name='category_classification',
+            field=models.CharField(blank=True, db_index=True, help_text='The category (category_0, category_1, category_2) that best matches the calculated weights', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='attractionquiz',
+            index=models.Index(fields=['social_preference', 'genre_preference', 'romantic_preference'], name='attraction_preferences_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personalityquiz',
+            index=models.Index(fields=['social_weight', 'genre_weight', 'romantic_weight'], name='personality_weights_idx'),
+        ),
+        migrations.RunPython(backfill_vector_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0011_checkin'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(unique=True)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-starts_at', '-id'],
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='matchgeneration',
+            name='single_active_match_generation',
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='attendees',
+            field=models.ManyToManyField(blank=True, related_name='events', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='matchgeneration',
+            name='event',
+            field=models.ForeignKey(blank=True, help_text='The event whose attendees were matched; empty for a site-wide run over every user', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='generations', to='eventapp.event'),
+        ),
+        migrations.AddConstraint(
+            model_name='matchgeneration',
+            constraint=models.UniqueConstraint(condition=models.Q(('event__isnull', True), ('is_active', True)), fields=('is_active',), name='single_active_match_generation'),
+        ),
+        migrations.AddConstraint(
+            model_name='matchgeneration',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('event',), name='single_active_match_generation_per_event'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0012_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('kind', models.CharField(blank=True, choices=[('incremental', 'Incremental: patch the dirty users into the active generation'), ('full', 'Full: a new generation from run_matching')], help_text='How the job was run, decided when it starts', max_length=12)),
+                ('dirty_user_ids', models.JSONField(default=list, help_text='Users whose quizzes changed, kept up to a limit past which only a full run makes sense')),
+                ('dirty_count', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(help_text='Debounced start: pushed back by each new submission, up to a limit')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, help_text='Seconds the run took', null=True)),
+                ('error', models.TextField(blank=True)),
+                ('event', models.ForeignKey(blank=True, help_text='The event to rematch; empty for the site-wide matches', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='match_jobs', to='eventapp.event')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['state', 'run_after'], name='match_job_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('event__isnull', True), ('state', 'queued')), fields=('state',), name='single_queued_match_job'), models.UniqueConstraint(condition=models.Q(('state', 'queued')), fields=('event',), name='single_queued_match_job_per_event')],
+            },
+        ),
+    ]
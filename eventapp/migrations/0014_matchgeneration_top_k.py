@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:04
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_top_k(apps, schema_editor):
+    """Existing generations keep the list length they were computed with."""
+    MatchGeneration = apps.get_model('eventapp', 'MatchGeneration')
+    for generation in MatchGeneration.objects.annotate(longest=Max('results__rank')):
+        if generation.longest:
+            generation.top_k = generation.longest
+            generation.save(update_fields=['top_k'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0013_matchjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchgeneration',
+            name='top_k',
+            field=models.PositiveSmallIntegerField(default=3, help_text='Matches kept per user, which incremental updates keep to as well'),
+        ),
+        migrations.RunPython(backfill_top_k, migrations.RunPython.noop),
+    ]
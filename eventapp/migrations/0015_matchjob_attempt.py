@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0014_matchgeneration_top_k'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchjob',
+            name='attempt',
+            field=models.PositiveSmallIntegerField(default=1, help_text='How many times these users have been tried; a failed job is queued again up to a limit'),
+        ),
+    ]
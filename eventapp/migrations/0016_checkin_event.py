@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventapp', '0015_matchjob_attempt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkin',
+            name='event',
+            field=models.ForeignKey(blank=True, help_text='The event they arrived at; empty for the site-wide event night', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='checkins', to='eventapp.event'),
+        ),
+        migrations.AlterField(
+            model_name='checkin',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkins', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='checkin',
+            constraint=models.UniqueConstraint(condition=models.Q(('event__isnull', True)), fields=('user',), name='single_site_wide_checkin'),
+        ),
+        migrations.AddConstraint(
+            model_name='checkin',
+            constraint=models.UniqueConstraint(fields=('user', 'event'), name='single_checkin_per_event'),
+        ),
+    ]
@@ -1,5 +1,34 @@
+import logging
+import random
+
 from django.conf import settings
 from django.db import models
+from django.db.models import F, Value
+
+from .cache import invalidate_quizzes
+from .categories import CATEGORY_GROUPS
+
+logger = logging.getLogger(__name__)
+
+
+def vector_columns(vector):
+    """Split a 3-value JSON vector into float column values (all None if incomplete)."""
+    if vector and len(vector) == 3:
+        return [float(value) for value in vector]
+    return [None, None, None]
+
+
+class VectorQuerySet(models.QuerySet):
+    """Queries on a model's denormalized VECTOR_FIELDS float columns."""
+
+    def within(self, vector, radius):
+        """Rows whose vector is within `radius` (Euclidean) of `vector`."""
+        fields = self.model.VECTOR_FIELDS
+
+        # A bounding box first, so the database can use the column index to narrow the scan
+        box = {f'{field}__range': (value - radius, value + radius) for field, value in zip(fields, vector)}
+        squared = sum(((F(field) - value) * (F(field) - value) for field, value in zip(fields, vector)), Value(0.0))
+        return self.filter(**box).alias(distance_squared=squared).filter(distance_squared__lte=radius * radius)
 
 
 class PersonalityQuiz(models.Model):
@@ -25,19 +54,8 @@ class PersonalityQuiz(models.Model):
     ]
 
     # Preset category groups by color with target weights for each category
-    # Category 0: AntiSocial (1) -> Social (5)
-    # Category 1: Books (1) -> Movies (5)  
-    # Category 2: Less Romantic (1) -> More Romantic (5)
-    CATEGORY_GROUPS = {
-        'Purple': {'weights': [5.0, 5.0, 5.0], 'description': 'Social, Movies, More Romantic'},
-        'red': {'weights': [3, 3, 3], 'description': 'Balanced'},
-        'gray': {'weights': [1.0, 1.0, 1.0], 'description': 'AntiSocial, Books, Less Romantic'},
-        'green': {'weights': [4.0, 2.0, 5.0], 'description': 'Social, Books, More Romantic'},
-        'blue': {'weights': [5.0, 5.0, 1.0], 'description': 'Social, Movies, Less Romantic'},
-        'pink': {'weights': [2.0, 1.0, 5.0], 'description': 'Moderate Social, Books, More Romantic'},
-        'orange': {'weights': [1.0, 5.0, 1.0], 'description': 'AntiSocial, Movies, Less Romantic'},
-        'beige': {'weights': [3.0, 4.0, 2], 'description': 'Moderate Social, Movies, Less Romantic'},
-    }
+    # (defined and compiled into a centroid index in classification.py)
+    CATEGORY_GROUPS = CATEGORY_GROUPS
 
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
@@ -58,16 +76,31 @@ class PersonalityQuiz(models.Model):
         help_text="Array of 3 weighted averages corresponding to categories"
     )
 
+    # calculated_weights copied into real float columns so SQL can filter and index on them
+    social_weight = models.FloatField(null=True, blank=True, help_text="calculated_weights[0]: AntiSocial (1) -> Social (5)")
+    genre_weight = models.FloatField(null=True, blank=True, help_text="calculated_weights[1]: Books (1) -> Movies (5)")
+    romantic_weight = models.FloatField(null=True, blank=True, help_text="calculated_weights[2]: Less (1) -> More Romantic (5)")
+
     # Stores the category classification
     category_classification = models.CharField(
         max_length=20,
         blank=True,
+        db_index=True,
         help_text="The category (category_0, category_1, category_2) that best matches the calculated weights"
     )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    VECTOR_FIELDS = ['social_weight', 'genre_weight', 'romantic_weight']
+
+    objects = VectorQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['social_weight', 'genre_weight', 'romantic_weight'], name='personality_weights_idx'),
+        ]
+
     def __str__(self):
         return f"Personality quiz for {self.user.username}"
 
@@ -81,27 +114,8 @@ class PersonalityQuiz(models.Model):
         if len(self.answers) < 9:
             raise ValueError("Answers array must contain at least 9 values")
 
-        # Define weights for each category
-        # Category 0: q0=0.3, q3=0.2, q6=0.5
-        # Category 1: q1=1/3, q4=1/3, q7=1/3 (equal)
-        # Category 2: q2=0.6, q5=0.2, q8=0.2
-        weights = [
-            [0.3, 0.2, 0.5],           # Category 0: indices [0, 3, 6]
-            [1/3, 1/3, 1/3],           # Category 1: indices [1, 4, 7] (equal weights)
-            [0.6, 0.2, 0.2],           # Category 2: indices [2, 5, 8]
-        ]
-        
-        indices = [
-            [0, 3, 6],                 # Category 0
-            [1, 4, 7],                 # Category 1
-            [2, 5, 8],                 # Category 2
-        ]
-
-        self.calculated_weights = []
-        for category_idx, idx_list in enumerate(indices):
-            weighted_sum = sum(self.answers[idx_list[i]] * weights[category_idx][i] for i in range(3))
-            self.calculated_weights.append(round(weighted_sum, 2))
-
+        from .classification import weights_from_answers
+        self.calculated_weights = weights_from_answers(self.answers[:9])[0].tolist()
         return self.calculated_weights
 
     def classify_category(self):
@@ -112,28 +126,28 @@ class PersonalityQuiz(models.Model):
         if not self.calculated_weights:
             self.calculate_weighted_averages()
 
-        best_category = None
-        best_distance = float('inf')
+        from .classification import CATEGORY_INDEX
+        self.category_classification = CATEGORY_INDEX.classify(self.calculated_weights)
+        return self.category_classification
 
-        for color_name, color_data in self.CATEGORY_GROUPS.items():
-            target_weights = color_data['weights']
-            
-            # Calculate Euclidean distance between calculated weights and target weights
-            distance = sum((self.calculated_weights[i] - target_weights[i]) ** 2 for i in range(3)) ** 0.5
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_category = color_name
-
-        self.category_classification = best_category
-        return best_category
+    def sync_vector_columns(self):
+        """Copy calculated_weights into the float columns."""
+        for field, value in zip(self.VECTOR_FIELDS, vector_columns(self.calculated_weights)):
+            setattr(self, field, value)
 
     def save(self, *args, **kwargs):
         """Override save to automatically calculate weights and classify category."""
         if self.answers and len(self.answers) >= 9:
             self.calculate_weighted_averages()
             self.classify_category()
+        self.sync_vector_columns()
         super().save(*args, **kwargs)
+        invalidate_quizzes(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_quizzes(self.user_id)
+        return result
 
 
 class AttractionQuiz(models.Model):
@@ -171,16 +185,31 @@ class AttractionQuiz(models.Model):
         help_text="Array of 3 preference values corresponding to categories"
     )
 
+    # preferences copied into real float columns so SQL can filter and index on them
+    social_preference = models.FloatField(null=True, blank=True, help_text="preferences[0]: AntiSocial (1) -> Social (5)")
+    genre_preference = models.FloatField(null=True, blank=True, help_text="preferences[1]: Books (1) -> Movies (5)")
+    romantic_preference = models.FloatField(null=True, blank=True, help_text="preferences[2]: Less (1) -> More Romantic (5)")
+
     # Stores the personality category they're most attracted to
     most_attracted_category = models.CharField(
         max_length=20,
         blank=True,
+        db_index=True,
         help_text="The personality category (color) they're most attracted to"
     )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    VECTOR_FIELDS = ['social_preference', 'genre_preference', 'romantic_preference']
+
+    objects = VectorQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['social_preference', 'genre_preference', 'romantic_preference'], name='attraction_preferences_idx'),
+        ]
+
     def __str__(self):
         return f"Attraction quiz for {self.user.username}"
 
@@ -201,27 +230,264 @@ class AttractionQuiz(models.Model):
         if not self.preferences:
             self.calculate_preferences()
 
-        best_category = None
-        best_distance = float('inf')
-
-        # Use the same CATEGORY_GROUPS from PersonalityQuiz
-        for color_name, color_data in PersonalityQuiz.CATEGORY_GROUPS.items():
-            target_weights = color_data['weights']
-            
-            # Calculate Euclidean distance between preferences and target weights
-            distance = sum((self.preferences[i] - target_weights[i]) ** 2 for i in range(3)) ** 0.5
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_category = color_name
+        # Use the same CATEGORY_GROUPS centroids as PersonalityQuiz
+        from .classification import CATEGORY_INDEX
+        self.most_attracted_category = CATEGORY_INDEX.classify(self.preferences)
+        return self.most_attracted_category
 
-        self.most_attracted_category = best_category
-        return best_category
+    def sync_vector_columns(self):
+        """Copy preferences into the float columns."""
+        for field, value in zip(self.VECTOR_FIELDS, vector_columns(self.preferences)):
+            setattr(self, field, value)
 
     def save(self, *args, **kwargs):
         """Override save to automatically calculate preferences and find attracted category."""
         if self.answers and len(self.answers) >= 3:
             self.calculate_preferences()
             self.find_most_attracted_category()
-            print(f"[DEBUG] AttractionQuiz: answers={self.answers}, preferences={self.preferences}, most_attracted_category={self.most_attracted_category}")
+            # Checked first so a disabled logger costs nothing, not even formatting
+            if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.QUIZ_LOG_SAMPLE_RATE:
+                logger.debug(
+                    "Attraction quiz saved user_id=%s preferences=%s most_attracted_category=%s",
+                    self.user_id, self.preferences, self.most_attracted_category,
+                    extra={
+                        'user_id': self.user_id,
+                        'preferences': self.preferences,
+                        'most_attracted_category': self.most_attracted_category,
+                    },
+                )
+        self.sync_vector_columns()
         super().save(*args, **kwargs)
+        invalidate_quizzes(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_quizzes(self.user_id)
+        return result
+
+
+class Event(models.Model):
+    """
+    One event night. Each event's attendees are matched among themselves, so a
+    run for an event only loads and scores the people going to it.
+    """
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(unique=True)
+    starts_at = models.DateTimeField(null=True, blank=True)
+    attendees = models.ManyToManyField(
+        settings.AUTH_USER_MODEL,
+        related_name='events',
+        blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-starts_at', '-id']
+
+    def __str__(self):
+        return self.name
+
+
+class MatchGeneration(models.Model):
+    """
+    One complete run of the matcher. Results are written under a new generation
+    and only become visible once that generation is activated, so readers never
+    see a half-built set of matches.
+    """
+    SCORING_CHOICES = [
+        ('personality', 'Personality similarity'),
+        ('mutual', 'Mutual attraction'),
+    ]
+
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='generations',
+        help_text="The event whose attendees were matched; empty for a site-wide run over every user"
+    )
+    scoring = models.CharField(
+        max_length=20,
+        choices=SCORING_CHOICES,
+        default='personality',
+        help_text="How the matches in this generation were scored"
+    )
+    one_to_one = models.BooleanField(
+        default=False,
+        help_text="Each user has exactly one match from a global pairing instead of a top-k list"
+    )
+    top_k = models.PositiveSmallIntegerField(
+        default=3,
+        help_text="Matches kept per user, which incremental updates keep to as well"
+    )
+    is_active = models.BooleanField(default=False)
+    row_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        constraints = [
+            # At most one site-wide generation is live at a time...
+            models.UniqueConstraint(
+                fields=['is_active'],
+                condition=models.Q(is_active=True, event__isnull=True),
+                name='single_active_match_generation',
+            ),
+            # ...and at most one per event
+            models.UniqueConstraint(
+                fields=['event'],
+                condition=models.Q(is_active=True),
+                name='single_active_match_generation_per_event',
+            ),
+        ]
+
+    def __str__(self):
+        state = "active" if self.is_active else "inactive"
+        scope = f" for {self.event}" if self.event_id else ""
+        return f"Match generation {self.pk}{scope} ({state}, {self.row_count} rows)"
+
+
+class MatchResultQuerySet(models.QuerySet):
+    def current(self, event=None):
+        """Only the rows of the currently active generation (site-wide, or for `event`)."""
+        return self.filter(generation__is_active=True, generation__event=event)
+
+
+class MatchResult(models.Model):
+    """One of a user's top matches, as computed by the run_matching command."""
+    generation = models.ForeignKey(
+        MatchGeneration,
+        on_delete=models.CASCADE,
+        related_name='results'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='my_matches'
+    )
+    match = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='matched_by'
+    )
+    score = models.FloatField(help_text="Similarity score or compatibility score")
+    rank = models.PositiveSmallIntegerField(help_text="1 = best match, 2 = second, etc.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MatchResultQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['rank']
+        unique_together = [('generation', 'user', 'rank')]
+
+    def __str__(self):
+        return f"{self.user.username} -> {self.match.username} (#{self.rank})"
+
+
+class MatchJob(models.Model):
+    """
+    A background recompute of one scope's matches: site-wide, or one event's.
+    A queued job collects the users whose quizzes changed until its debounced
+    start time; the match_worker command then runs it (see scheduler.py).
+    """
+    STATE_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    KIND_CHOICES = [
+        ('incremental', 'Incremental: patch the dirty users into the active generation'),
+        ('full', 'Full: a new generation from run_matching'),
+    ]
+
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='match_jobs',
+        help_text="The event to rematch; empty for the site-wide matches"
+    )
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='queued')
+    kind = models.CharField(
+        max_length=12,
+        choices=KIND_CHOICES,
+        blank=True,
+        help_text="How the job was run, decided when it starts"
+    )
+    dirty_user_ids = models.JSONField(
+        default=list,
+        help_text="Users whose quizzes changed, kept up to a limit past which only a full run makes sense"
+    )
+    dirty_count = models.PositiveIntegerField(default=0)
+    attempt = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="How many times these users have been tried; a failed job is queued again up to a limit"
+    )
+    run_after = models.DateTimeField(help_text="Debounced start: pushed back by each new submission, up to a limit")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds the run took")
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['state', 'run_after'], name='match_job_queue_idx'),
+        ]
+        constraints = [
+            # Submissions pile onto one queued job per scope
+            models.UniqueConstraint(
+                fields=['state'],
+                condition=models.Q(state='queued', event__isnull=True),
+                name='single_queued_match_job',
+            ),
+            models.UniqueConstraint(
+                fields=['event'],
+                condition=models.Q(state='queued'),
+                name='single_queued_match_job_per_event',
+            ),
+        ]
+
+    def __str__(self):
+        scope = f" for {self.event}" if self.event_id else ""
+        return f"Match job {self.pk}{scope} ({self.state}, {self.dirty_count} dirty)"
+
+
+class CheckIn(models.Model):
+    """
+    A user who has arrived at an event (or at the site-wide event night). One
+    row per user and event, so checking in twice is a no-op.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='checkins'
+    )
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='checkins',
+        help_text="The event they arrived at; empty for the site-wide event night"
+    )
+    checked_in_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(event__isnull=True),
+                name='single_site_wide_checkin',
+            ),
+            models.UniqueConstraint(fields=['user', 'event'], name='single_checkin_per_event'),
+        ]
+
+    def __str__(self):
+        scope = f" {self.event}" if self.event_id else ""
+        return f"{self.user.username} checked in at{scope} {self.checked_in_at:%H:%M}"
@@ -0,0 +1,102 @@
+"""
+Sharded top-k matching on a process pool.
+
+The population's vectors are written once to a .npy file that every worker
+memory-maps read-only, so the matrix is shared through the page cache
+instead of being pickled to each process. Workers write their shard's lists
+straight into shared memory-mapped output files; only shard boundaries go
+over the pipes. Every row is scored exactly as in a single-process run and
+each shard owns its rows, so the result is the same whatever the number of
+workers or the order in which shards finish.
+
+Workers are spawned rather than forked, so they don't inherit the parent's
+database connections or threads. This module is what they import first,
+so it must not import the models at the top.
+"""
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# Shards per worker; several smaller shards even out workers finishing at different times
+SHARDS_PER_WORKER = 4
+
+# What each worker process opened in _start_worker
+_worker = {}
+
+
+def sharded_top_k(population, width, scorer, workers, block_size=None, members=None):
+    """
+    Lists of length `width` for every row of `population` using `workers`
+    processes: user_rows_top_k, or bucket_rows_top_k when `members` (bucket
+    first members) is given, in which case `population` holds one stand-in
+    user per bucket.
+    """
+    from .matching import SCORERS
+
+    scorer_name = next(name for name, function in SCORERS.items() if function is scorer)
+    rows = len(population)
+
+    with tempfile.TemporaryDirectory(prefix='matching-') as directory:
+        directory = Path(directory)
+        vectors = population.weights
+        if population.preferences is not None:
+            vectors = np.hstack([population.weights, population.preferences])
+        np.save(directory / 'vectors.npy', vectors)
+        if members is not None:
+            np.save(directory / 'members.npy', members)
+        indices = np.lib.format.open_memmap(directory / 'indices.npy', mode='w+', dtype=np.int64, shape=(rows, width))
+        scores = np.lib.format.open_memmap(directory / 'scores.npy', mode='w+', dtype=np.float64, shape=(rows, width))
+
+        bounds = np.unique(np.linspace(0, rows, workers * SHARDS_PER_WORKER + 1).astype(np.int64))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_start_worker,
+            initargs=(str(directory), scorer_name, block_size),
+        ) as pool:
+            # map() re-raises the first worker error here
+            for _ in pool.map(_run_shard, bounds[:-1].tolist(), bounds[1:].tolist()):
+                pass
+
+        # Copy the results out before the files go
+        result = np.array(indices), np.array(scores)
+        del indices, scores
+    return result
+
+
+def _start_worker(directory, scorer_name, block_size):
+    import django
+    django.setup()
+    from .matching import SCORERS, Population
+
+    directory = Path(directory)
+    vectors = np.load(directory / 'vectors.npy', mmap_mode='r')
+    members_path = directory / 'members.npy'
+    _worker.update(
+        population=Population(
+            np.arange(len(vectors)),
+            vectors[:, :3],
+            vectors[:, 3:] if vectors.shape[1] > 3 else None,
+        ),
+        members=np.load(members_path, mmap_mode='r') if members_path.exists() else None,
+        indices=np.load(directory / 'indices.npy', mmap_mode='r+'),
+        scores=np.load(directory / 'scores.npy', mmap_mode='r+'),
+        scorer=SCORERS[scorer_name],
+        block_size=block_size,
+    )
+
+
+def _run_shard(start, stop):
+    from .matching import bucket_rows_top_k, user_rows_top_k
+
+    population, members = _worker['population'], _worker['members']
+    if members is None:
+        width = _worker['indices'].shape[1]
+        lists = user_rows_top_k(population, start, stop, width, _worker['scorer'], _worker['block_size'])
+    else:
+        lists = bucket_rows_top_k(population, members, start, stop, _worker['scorer'], _worker['block_size'])
+    _worker['indices'][start:stop], _worker['scores'][start:stop] = lists
+    return stop - start
@@ -0,0 +1,285 @@
+"""
+Debounced background matching.
+
+Quiz submissions don't score anything during the request. request_matching
+marks the user dirty on the queued MatchJob of every scope they belong to
+(the site-wide matches, plus each event they attend) and pushes the job's
+start back to MATCH_DEBOUNCE_SECONDS from now, but never further than
+MATCH_MAX_DELAY_SECONDS after it was queued. A burst of submissions becomes
+one job per scope.
+
+The match_worker command claims due jobs and runs them. Each job picks how
+to run when it starts: a few dirty users are patched into the active
+generation one at a time (match_store.update_user_matches, O(n) each); many
+of them, or no generation to patch, means a full run_matching for the
+scope. "Many" is worked out from how long the scope's earlier jobs took, or
+is MATCH_FULL_RUN_DIRTY before there are any. A job that fails queues its
+users again, up to MAX_ATTEMPTS tries in all.
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import match_store
+from .models import Event, MatchJob
+
+logger = logging.getLogger(__name__)
+
+# Dirty users tracked on one job; past this many only a full run makes sense anyway
+MAX_TRACKED_USERS = 1000
+
+# Finished jobs kept for the status page and for timing estimates
+KEEP_FINISHED_JOBS = 200
+
+# Jobs listed on the status page
+RECENT_JOBS = 20
+
+# Due jobs looked at per claim attempt, in case other workers take the first ones
+CLAIM_CANDIDATES = 5
+
+# Tries a job's users get, counting the first, before a failure drops them
+MAX_ATTEMPTS = 3
+
+
+def refresh_matches(user_id):
+    """
+    Bring matches up to date after `user_id` submits a quiz: queue them for
+    match_worker, or patch them in right away when MATCH_IN_BACKGROUND is off.
+    The quiz is already saved, so a database that is too busy to patch (an
+    untuned SQLite file under concurrent submissions) only queues the user.
+    """
+    if settings.MATCH_IN_BACKGROUND:
+        request_matching(user_id)
+        return
+
+    try:
+        match_store.update_user_everywhere(user_id)
+    except OperationalError:
+        logger.warning("Patching the matches of user %s failed; queuing them instead", user_id, exc_info=True)
+        try:
+            request_matching(user_id)
+        except DatabaseError:
+            logger.exception("Queuing user %s for matching failed too; the next full run picks them up", user_id)
+
+
+def request_matching(user_id):
+    """Mark `user_id` dirty site-wide and at every event they attend. Returns the queued jobs."""
+    event_ids = [None, *Event.objects.filter(attendees=user_id).values_list('pk', flat=True)]
+    return [mark_dirty(event_id, [user_id]) for event_id in event_ids]
+
+
+def mark_dirty(event_id, user_ids, untracked=0, attempt=1):
+    """
+    Add `user_ids` to the queued job of one scope (event_id None for the
+    site-wide matches), queuing one if there isn't any, and push its start
+    back. `untracked` counts further dirty users whose ids aren't known, and
+    `attempt` is the try they're on when a failed job queues them again.
+    """
+    for tries in range(2):
+        try:
+            with transaction.atomic():
+                return _mark_dirty(event_id, user_ids, untracked, attempt)
+        except IntegrityError:
+            # Another submission queued this scope's job at the same moment; join it
+            if tries:
+                raise
+
+
+def _mark_dirty(event_id, user_ids, untracked, attempt):
+    now = timezone.now()
+    job = MatchJob.objects.select_for_update().filter(state='queued', event_id=event_id).first()
+    if job is None:
+        job = MatchJob(event_id=event_id, created_at=now)
+
+    known = set(job.dirty_user_ids)
+    fresh = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in known]
+    job.dirty_count += len(fresh) + untracked
+    job.attempt = max(job.attempt, attempt)
+    job.dirty_user_ids = job.dirty_user_ids + fresh[:max(MAX_TRACKED_USERS - len(job.dirty_user_ids), 0)]
+    job.run_after = min(
+        now + timedelta(seconds=settings.MATCH_DEBOUNCE_SECONDS),
+        job.created_at + timedelta(seconds=settings.MATCH_MAX_DELAY_SECONDS),
+    )
+    job.save()
+    return job
+
+
+def claim_next():
+    """The next due job, marked running, or None. Safe with several workers."""
+    now = timezone.now()
+    due = MatchJob.objects.filter(state='queued', run_after__lte=now).order_by('run_after')
+    for job_id in due.values_list('pk', flat=True)[:CLAIM_CANDIDATES]:
+        # Only one worker's update can find the job still queued
+        if MatchJob.objects.filter(pk=job_id, state='queued').update(state='running', started_at=now):
+            # Submissions may have joined it since it was listed
+            return MatchJob.objects.select_related('event').get(pk=job_id)
+    return None
+
+
+def seconds_until_due():
+    """How long until the next queued job is due (0 if one already is), or None with an empty queue."""
+    queued = MatchJob.objects.filter(state='queued')
+    run_after = queued.order_by('run_after').values_list('run_after', flat=True).first()
+    if run_after is None:
+        return None
+    return max((run_after - timezone.now()).total_seconds(), 0.0)
+
+
+def run_job(job, stdout=None):
+    """
+    Run a claimed job and record the outcome on it. run_matching's output goes
+    to `stdout`. If it fails, its users are queued again for another try.
+    """
+    started = time.perf_counter()
+    try:
+        generation = match_store.active_generation(job.event)
+        job.kind = choose_kind(job, generation)
+        MatchJob.objects.filter(pk=job.pk).update(kind=job.kind)  # Shows on the status page while it runs
+
+        if job.kind == 'incremental':
+            for user_id in job.dirty_user_ids:
+                match_store.update_user_matches(user_id, event=job.event)
+        else:
+            rematch(job.event, generation, stdout)
+        job.state = 'done'
+    except Exception:
+        logger.exception("Match job %s failed", job.pk)
+        job.state = 'failed'
+        job.error = traceback.format_exc()
+
+    job.duration = time.perf_counter() - started
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'kind', 'duration', 'finished_at', 'error'])
+
+    if job.state == 'failed':
+        if job.attempt < MAX_ATTEMPTS:
+            requeue(job, attempt=job.attempt + 1)
+        else:
+            logger.error(
+                "Giving up on the %s dirty user(s) of match job %s after %s attempts",
+                job.dirty_count, job.pk, job.attempt,
+            )
+    return job
+
+
+def requeue(job, attempt):
+    """Queue the dirty users of `job` again, on try `attempt`."""
+    return mark_dirty(
+        job.event_id, job.dirty_user_ids, untracked=job.dirty_count - len(job.dirty_user_ids), attempt=attempt,
+    )
+
+
+def choose_kind(job, generation):
+    """'incremental' or 'full' for `job`, about to run against the scope's active `generation`."""
+    if generation is None or generation.one_to_one or job.dirty_count > len(job.dirty_user_ids):
+        # Nothing to patch, pairs that can't be patched locally, or dirty users we can't name
+        return 'full'
+
+    per_user, full = estimates(job.event_id)
+    if per_user is not None and full is not None:
+        return 'incremental' if job.dirty_count * per_user < full else 'full'
+    return 'incremental' if job.dirty_count <= settings.MATCH_FULL_RUN_DIRTY else 'full'
+
+
+def estimates(event_id):
+    """
+    (seconds per user patched, seconds per full run) from the scope's latest
+    finished jobs of each kind, with None for a kind that hasn't run yet.
+    """
+    done = MatchJob.objects.filter(state='done', event_id=event_id).order_by('-id')
+    incremental = done.filter(kind='incremental', dirty_count__gt=0).values_list('duration', 'dirty_count').first()
+    full = done.filter(kind='full').values_list('duration', flat=True).first()
+    return (incremental[0] / incremental[1] if incremental else None), full
+
+
+def rematch(event, generation, stdout=None):
+    """A new generation for the scope, scored the way its active `generation` was (if any)."""
+    options = {'event': [event.slug] if event else []}
+    if generation is not None:
+        options.update(scoring=generation.scoring, assignment=generation.one_to_one, top_k=generation.top_k)
+    call_command('run_matching', stdout=stdout or StringIO(), **options)
+
+
+def requeue_interrupted():
+    """
+    Fail the jobs a stopped worker left running and queue their users again.
+    Only call this while no other worker is running. Returns how many there were.
+    """
+    interrupted = list(MatchJob.objects.filter(state='running'))
+    for job in interrupted:
+        with transaction.atomic():
+            MatchJob.objects.filter(pk=job.pk).update(
+                state='failed', finished_at=timezone.now(), error="The worker stopped while this job ran.",
+            )
+            # Being stopped isn't the job's fault, so it doesn't use up a try
+            requeue(job, attempt=job.attempt)
+    return len(interrupted)
+
+
+def prune_jobs(keep=KEEP_FINISHED_JOBS):
+    """Delete finished jobs beyond the newest `keep`."""
+    stale = list(
+        MatchJob.objects.filter(state__in=['done', 'failed']).order_by('-id').values_list('pk', flat=True)[keep:]
+    )
+    if stale:
+        MatchJob.objects.filter(pk__in=stale).delete()
+    return len(stale)
+
+
+def job_counts():
+    """{state: number of jobs} for every state."""
+    counts = dict(MatchJob.objects.order_by().values_list('state').annotate(Count('pk')))
+    return {state: counts.get(state, 0) for state, _ in MatchJob.STATE_CHOICES}
+
+
+def last_runs():
+    """{kind: the latest finished job of that kind}."""
+    finished = MatchJob.objects.filter(state__in=['done', 'failed']).select_related('event').order_by('-id')
+    return {
+        kind: job for kind, _ in MatchJob.KIND_CHOICES
+        if (job := finished.filter(kind=kind).first()) is not None
+    }
+
+
+def oldest_queued_seconds():
+    """How long the longest-waiting queued job has been queued (0 with an empty queue)."""
+    queued = MatchJob.objects.filter(state='queued')
+    created_at = queued.order_by('created_at').values_list('created_at', flat=True).first()
+    return (timezone.now() - created_at).total_seconds() if created_at else 0.0
+
+
+def describe(job):
+    return {
+        'id': job.pk,
+        'event': job.event.slug if job.event_id else None,
+        'state': job.state,
+        'kind': job.kind or None,
+        'dirty_users': job.dirty_count,
+        'attempt': job.attempt,
+        'created_at': job.created_at,
+        'run_after': job.run_after,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'duration_seconds': job.duration,
+        'error': job.error.strip().splitlines()[-1] if job.error else None,
+    }
+
+
+def status():
+    """Queue depth, job states and recent runs, for the status endpoint."""
+    counts = job_counts()
+    return {
+        'queue_depth': counts['queued'],
+        'oldest_queued_seconds': oldest_queued_seconds(),
+        'jobs': counts,
+        'last_run': {kind: describe(job) for kind, job in last_runs().items()},
+        'recent': [describe(job) for job in MatchJob.objects.select_related('event')[:RECENT_JOBS]],
+    }
@@ -0,0 +1,142 @@
+"""
+Synthetic attendees for benchmarks and rehearsals.
+
+Answers are drawn the way Likert responses tend to look in practice rather
+than uniformly: each attendee leans towards one of the CATEGORY_GROUPS
+types, answers the three questions about a trait consistently, and has a
+personal bias towards one end of the scale. Attraction answers mostly
+describe someone like the attendee, sometimes a different type.
+
+Everything comes from one NumPy generator, so the same seed always gives
+the same population.
+"""
+import re
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .categories import CATEGORY_GROUPS
+from .classification import CATEGORY_INDEX, weights_from_answers
+from .models import AttractionQuiz, Event, PersonalityQuiz
+
+# The category groups' target weights, used as personality types
+TYPES = np.array([group['weights'] for group in CATEGORY_GROUPS.values()], dtype=np.float64)
+
+# Personality question i measures trait i % 3 (see classification.ANSWER_WEIGHTS)
+QUESTION_TRAITS = np.arange(9) % 3
+
+# How far attendees stray from their type, per trait
+TRAIT_SPREAD = 0.7
+
+# Noise on each individual answer
+ANSWER_NOISE = 0.8
+
+# Spread of the per-attendee lean towards agreeing (or disagreeing) with everything
+BIAS_SPREAD = 0.3
+
+# Share of attendees who are attracted to people like themselves
+SIMILAR_ATTRACTION = 0.6
+
+
+def likert(values):
+    """Round onto the 1-5 scale."""
+    return np.clip(np.rint(values), 1, 5).astype(np.int64)
+
+
+def answers(n, seed=0):
+    """Personality (n, 9) and attraction (n, 3) answers for `n` attendees."""
+    rng = np.random.default_rng(seed)
+    traits = TYPES[rng.integers(len(TYPES), size=n)] + rng.normal(0, TRAIT_SPREAD, size=(n, 3))
+    bias = rng.normal(0, BIAS_SPREAD, size=(n, 1))
+    personality = likert(traits[:, QUESTION_TRAITS] + bias + rng.normal(0, ANSWER_NOISE, size=(n, 9)))
+
+    similar = rng.random(n) < SIMILAR_ATTRACTION
+    wanted = np.where(similar[:, None], traits, TYPES[rng.integers(len(TYPES), size=n)])
+    attraction = likert(wanted + rng.normal(0, ANSWER_NOISE, size=(n, 3)))
+    return personality, attraction
+
+
+def insert_rows(model, field_names, rows, batch_size):
+    """
+    INSERT `rows` of database-ready values for `field_names` with executemany.
+    bulk_create prepares every value of every row through the field API, which
+    is most of the cost at this size; these rows are built already prepared.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in field_names)
+    placeholders = ', '.join(['%s'] * len(field_names))
+    sql = f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start:start + batch_size])
+
+
+def seeded_users(prefix):
+    """Users named the way create_attendees names them: `prefix` and a number, nothing else."""
+    return get_user_model().objects.filter(username__regex=rf'^{re.escape(prefix)}\d+$')
+
+
+def create_attendees(n, seed=0, prefix='guest', password='!', batch_size=5000, event=None):
+    """
+    Insert `n` users named <prefix><i> with both quizzes filled in, in one
+    transaction. Weights and categories are computed for the whole batch at
+    once, exactly as the quiz models' save() would. Every user gets the same
+    `password` hash ('!' means nobody can log in) and, given an `event`, is
+    one of its attendees. No seeded_users(prefix) may exist yet.
+    Returns their ids in order.
+    """
+    personality, attraction = answers(n, seed)
+    weights = weights_from_answers(personality)
+    categories = CATEGORY_INDEX.classify_many(weights)
+    attracted = CATEGORY_INDEX.classify_many(attraction)
+
+    User = get_user_model()
+    # Values shared by every row are prepared once
+    now = User._meta.get_field('date_joined').get_db_prep_save(timezone.now(), connection)
+    json = connection.ops.adapt_json_value
+    usernames = [f'{prefix}{i}' for i in range(n)]
+
+    with transaction.atomic():
+        insert_rows(
+            User,
+            ['username', 'password', 'first_name', 'last_name', 'email',
+             'is_superuser', 'is_staff', 'is_active', 'date_joined'],
+            [(username, password, '', '', '', False, False, True, now) for username in usernames],
+            batch_size,
+        )
+        ids = dict(seeded_users(prefix).values_list('username', 'pk'))
+        user_ids = [ids[username] for username in usernames]
+
+        insert_rows(
+            PersonalityQuiz,
+            ['user', 'answers', 'calculated_weights', *PersonalityQuiz.VECTOR_FIELDS,
+             'category_classification', 'created_at', 'updated_at'],
+            [
+                (user_id, json(row, None), json(vector, None), *vector, category, now, now)
+                for user_id, row, vector, category in zip(
+                    user_ids, personality.tolist(), weights.tolist(), categories
+                )
+            ],
+            batch_size,
+        )
+        insert_rows(
+            AttractionQuiz,
+            ['user', 'answers', 'preferences', *AttractionQuiz.VECTOR_FIELDS,
+             'most_attracted_category', 'created_at', 'updated_at'],
+            [
+                (user_id, json(row, None), json(row, None), *map(float, row), category, now, now)
+                for user_id, row, category in zip(user_ids, attraction.tolist(), attracted)
+            ],
+            batch_size,
+        )
+        if event is not None:
+            insert_rows(
+                Event.attendees.through,
+                ['event', 'user'],
+                [(event.pk, user_id) for user_id in user_ids],
+                batch_size,
+            )
+
+    return user_ids
@@ -1,3 +1,593 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+from datetime import timedelta
+from functools import lru_cache
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import OperationalError
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import match_store, metrics, scheduler, synthetic, views
+from .assignment import pair_up
+from .cache import LOCAL_TIMEOUT, MATCHES_TIMEOUT, categories_of, category_of, match_list, timeout_for
+from .categories import CATEGORY_GROUPS
+from .checkins import HUB, CheckInHub, CheckInWriter
+from .classification import CATEGORY_INDEX, weights_from_answers
+from .matching import (
+    Buckets, Population, bucket_top_k, mutual_scores, personality_scores, stream_top_k, top_k, user_rows_top_k,
+)
+from .models import CheckIn, Event, MatchGeneration, MatchJob, MatchResult, PersonalityQuiz
+
+
+def stored_lists(generation):
+    """{user_id: [match_id, ...]} for a generation, best first."""
+    lists = {}
+    rows = MatchResult.objects.filter(generation=generation).order_by('user_id', 'rank')
+    for user_id, match_id in rows.values_list('user_id', 'match_id'):
+        lists.setdefault(user_id, []).append(match_id)
+    return lists
+
+
+class IncrementalUpdateTests(TestCase):
+    """update_user_matches must leave the same lists a full run would."""
+
+    def setUp(self):
+        self.user_ids = synthetic.create_attendees(60, seed=3)
+
+    def full_lists(self, k, event=None):
+        population = Population.load(event=event)
+        indices, _ = top_k(population, k=k)
+        return {
+            user_id: matches
+            for user_id, matches in zip(population.user_ids.tolist(), population.user_ids[indices].tolist())
+        }
+
+    def change_quizzes(self, k):
+        generation = match_store.active_generation()
+        rng = np.random.default_rng(k)
+        for user_id in self.user_ids[::7]:
+            quiz = PersonalityQuiz.objects.get(user_id=user_id)
+            quiz.answers = rng.integers(1, 6, size=9).tolist()
+            quiz.save()
+            match_store.update_user_matches(user_id)
+            self.assertEqual(stored_lists(generation), self.full_lists(k))
+
+    def test_patches_match_a_full_run(self):
+        call_command('run_matching', stdout=StringIO())
+        self.assertEqual(match_store.active_generation().top_k, 3)
+        self.change_quizzes(3)
+
+    def test_patches_keep_the_generations_top_k(self):
+        call_command('run_matching', top_k=5, stdout=StringIO())
+        self.assertEqual(match_store.active_generation().top_k, 5)
+        self.change_quizzes(5)
+
+    def test_users_who_leave_drop_out_of_every_list(self):
+        event = Event.objects.create(name="Spring", slug='spring')
+        event.attendees.set(self.user_ids[:30])
+        call_command('run_matching', stdout=StringIO())
+        call_command('run_matching', event=['spring'], stdout=StringIO())
+        everyone, at_event = match_store.active_generation(), match_store.active_generation(event)
+
+        leaver, quitter = self.user_ids[:2]
+        self.assertTrue(MatchResult.objects.filter(generation=at_event, match_id=leaver).exists())
+        event.attendees.remove(leaver)
+        match_store.update_user_everywhere(leaver)
+        self.assertEqual(stored_lists(at_event), self.full_lists(3, event))
+
+        self.assertTrue(MatchResult.objects.filter(generation=everyone, match_id=quitter).exists())
+        PersonalityQuiz.objects.filter(user_id=quitter).delete()
+        match_store.update_user_everywhere(quitter)
+        self.assertEqual(stored_lists(everyone), self.full_lists(3))
+        self.assertEqual(stored_lists(at_event), self.full_lists(3, event))
+
+
+class MatchStoreTests(TestCase):
+    """publish must swap a complete generation in at once and prune the old ones after commit."""
+
+    def setUp(self):
+        cache.clear()
+        self.user_ids = synthetic.create_attendees(4, seed=2)
+
+    def publish(self, shift, **kwargs):
+        """Every user's single match is the user `shift` places after them."""
+        matches = [[self.user_ids[(i + shift) % 4]] for i in range(4)]
+        with self.captureOnCommitCallbacks(execute=True):
+            return match_store.publish(self.user_ids, matches, [[0.5]] * 4, **kwargs)
+
+    def test_swaps_in_and_prunes(self):
+        event = Event.objects.create(name="Spring", slug='spring')
+        at_event = self.publish(1, event=event)
+        first = self.publish(1)
+        self.assertEqual(match_list(self.user_ids[0])[0]['match_id'], self.user_ids[1])
+
+        generations = [first] + [self.publish(shift) for shift in (2, 3)]
+        self.assertEqual(match_list(self.user_ids[0])[0]['match_id'], self.user_ids[3])
+        self.assertEqual(match_store.active_generation(), generations[-1])
+        self.assertEqual(generations[-1].row_count, 4)
+
+        # The newest KEEP_GENERATIONS site-wide generations survive, with their rows
+        kept = generations[-match_store.KEEP_GENERATIONS:]
+        self.assertQuerySetEqual(MatchGeneration.objects.filter(event=None), kept[::-1])
+        self.assertEqual(MatchResult.objects.filter(generation__event=None).count(), 4 * len(kept))
+        # Pruning the site-wide history leaves the event's alone
+        self.assertEqual(match_store.active_generation(event), at_event)
+
+    def test_failed_publish_keeps_the_active_generation(self):
+        active = self.publish(1)
+        match_list(self.user_ids[0])
+        with mock.patch.object(match_store, 'activate', side_effect=OperationalError), \
+                self.assertRaises(OperationalError):
+            self.publish(2)
+        self.assertQuerySetEqual(MatchGeneration.objects.all(), [active])
+        self.assertEqual(MatchResult.objects.count(), 4)
+        self.assertEqual(match_list(self.user_ids[0])[0]['match_id'], self.user_ids[1])
+
+
+def seeded_population(n, seed=0, with_preferences=False):
+    """A Population built straight from synthetic answers, without the database."""
+    personality, attraction = synthetic.answers(n, seed)
+    return Population(np.arange(1, n + 1), weights_from_answers(personality), attraction if with_preferences else None)
+
+
+def best_pairing_score(weights):
+    """The best total of any pairing of a small complete graph, by dynamic programming over subsets."""
+    n = len(weights)
+
+    @lru_cache(maxsize=None)
+    def best(remaining):
+        if not remaining:
+            return 0.0
+        first = (remaining & -remaining).bit_length() - 1
+        rest = remaining & ~(1 << first)
+        value = best(rest)  # `first` stays unpaired
+        for other in range(first + 1, n):
+            if rest >> other & 1:
+                value = max(value, weights[first, other] + best(rest & ~(1 << other)))
+        return value
+
+    return best((1 << n) - 1)
+
+
+class AssignmentTests(SimpleTestCase):
+    """pair_up's reported bound must hold, and its pairing must be close to it."""
+
+    def test_bound_holds_on_small_populations(self):
+        for seed in range(5):
+            population = seeded_population(12, seed=seed)
+            weights = personality_scores(population, 0, len(population))
+            pairing = pair_up(population, k=len(population) - 1)
+
+            # With every pair a candidate, the bound covers every pairing
+            best = best_pairing_score(weights)
+            self.assertLessEqual(pairing.objective, best + 1e-9)
+            self.assertLessEqual(best, pairing.upper_bound + 1e-9)
+            self.assertEqual(len(pairing), 6)
+
+    def test_gap_is_small_on_a_seeded_population(self):
+        population = seeded_population(600, seed=7)
+        pairing = pair_up(population, k=10)
+        users = [user for pair in pairing.pairs for user in pair]
+        self.assertEqual(len(users), len(set(users)))
+        self.assertEqual(len(users), len(population))
+        self.assertGreaterEqual(pairing.gap, 0)
+        self.assertLess(pairing.gap, 0.01 * pairing.upper_bound)
+
+
+class ClassificationTests(SimpleTestCase):
+    """The vectorized classifier must agree with a plain nearest-group loop, ties included."""
+
+    def reference(self, vector):
+        best_category, best_distance = None, float('inf')
+        for name, group in CATEGORY_GROUPS.items():
+            distance = sum((vector[i] - group['weights'][i]) ** 2 for i in range(3)) ** 0.5
+            if distance < best_distance:
+                best_category, best_distance = name, distance
+        return best_category
+
+    def test_matches_reference_loop(self):
+        personality, attraction = synthetic.answers(2000, seed=8)
+        # Every point of the answer grid too, where ties between groups are most likely
+        grid = np.stack(np.meshgrid(*[np.arange(1, 6)] * 3), axis=-1).reshape(-1, 3)
+        for vectors in (weights_from_answers(personality), attraction, grid):
+            expected = [self.reference(vector) for vector in vectors.tolist()]
+            self.assertEqual(CATEGORY_INDEX.classify_many(vectors), expected)
+            self.assertEqual([CATEGORY_INDEX.classify(vector) for vector in vectors.tolist()], expected)
+
+
+class BucketScoringTests(SimpleTestCase):
+    """Scoring bucket by bucket must give exactly the user-by-user lists."""
+
+    def assertSameLists(self, population, scorer, k):
+        expected = user_rows_top_k(population, 0, len(population), k, scorer)
+        buckets = Buckets(population, with_preferences=scorer is not personality_scores)
+        self.assertLess(len(buckets), len(population))
+        actual = bucket_top_k(population, buckets, k, scorer)
+        np.testing.assert_array_equal(actual[0], expected[0])
+        np.testing.assert_array_equal(actual[1], expected[1])
+
+    def test_personality(self):
+        for k in (1, 3, 10):
+            self.assertSameLists(seeded_population(400, seed=1), personality_scores, k)
+
+    def test_mutual(self):
+        for k in (1, 3, 10):
+            self.assertSameLists(seeded_population(400, seed=2, with_preferences=True), mutual_scores, k)
+
+
+class StreamedTopKTests(SimpleTestCase):
+    """Streaming through small tiles must give exactly the in-memory lists."""
+
+    def test_matches_in_memory(self):
+        for scorer, population in [
+            (personality_scores, seeded_population(300, seed=4)),
+            (mutual_scores, seeded_population(300, seed=5, with_preferences=True)),
+        ]:
+            expected = top_k(population, k=4, scorer=scorer)
+            indices = np.empty((len(population), 4), dtype=np.int64)
+            scores = np.empty((len(population), 4))
+            # Room for a few thousand cells, so rows and columns both span many tiles
+            stream_top_k(population, indices, scores, scorer=scorer, budget_bytes=64 * 2000)
+            np.testing.assert_array_equal(indices, expected[0])
+            np.testing.assert_array_equal(scores, expected[1])
+
+
+class ShardedTopKTests(SimpleTestCase):
+    """A process pool must give exactly the single-process lists."""
+
+    def test_matches_single_process(self):
+        population = seeded_population(300, seed=6, with_preferences=True)
+        for scorer in (personality_scores, mutual_scores):
+            expected = top_k(population, k=3, scorer=scorer)
+            actual = top_k(population, k=3, scorer=scorer, workers=2)
+            np.testing.assert_array_equal(actual[0], expected[0])
+            np.testing.assert_array_equal(actual[1], expected[1])
+
+
+class DashboardCacheTests(TestCase):
+    """The dashboard is built once per user and rebuilt as soon as either quiz changes."""
+
+    def setUp(self):
+        cache.clear()
+        [self.user_id] = synthetic.create_attendees(1, seed=4)
+        self.client.force_login(get_user_model().objects.get(pk=self.user_id))
+
+    def dashboard(self):
+        with mock.patch.object(views, 'dashboard_context', wraps=views.dashboard_context) as build:
+            response = self.client.get(reverse('dashboard'))
+        keys = ('has_quiz', 'category', 'calculated_weights', 'has_attraction_quiz', 'attracted_category')
+        return {key: response.context[key] for key in keys}, build.call_count
+
+    def test_rebuilt_after_quiz_changes(self):
+        context, builds = self.dashboard()
+        self.assertEqual(builds, 1)
+        self.assertEqual(self.dashboard(), (context, 0))
+
+        quiz = PersonalityQuiz.objects.get(user_id=self.user_id)
+        quiz.answers = [6 - answer for answer in quiz.answers]
+        quiz.save()
+        context, builds = self.dashboard()
+        self.assertEqual(builds, 1)
+        self.assertEqual(context['calculated_weights'], quiz.calculated_weights)
+
+        self.assertTrue(context['has_attraction_quiz'])
+        get_user_model().objects.get(pk=self.user_id).attraction_quiz.delete()
+        context, builds = self.dashboard()
+        self.assertEqual(builds, 1)
+        self.assertFalse(context['has_attraction_quiz'])
+
+
+class EventStreamTests(TestCase):
+    """The event page's stream must push check-ins of the viewer's matches at that event only."""
+
+    def setUp(self):
+        cache.clear()
+        self.user_ids = synthetic.create_attendees(10, seed=9)
+        self.event = Event.objects.create(name="Spring", slug='spring')
+        self.event.attendees.set(self.user_ids)
+        call_command('run_matching', event=['spring'], stdout=StringIO())
+
+    def test_page_shows_each_matchs_category(self):
+        self.client.force_login(get_user_model().objects.get(pk=self.user_ids[0]))
+        response = self.client.get(reverse('event_detail', args=['spring']))
+        statuses = response.context['match_statuses']
+        self.assertEqual(len(statuses), 3)
+        for status in statuses:
+            category = PersonalityQuiz.objects.get(user_id=status['match']['match_id']).category_classification
+            self.assertEqual(status['category'], category)
+            self.assertContains(response, f'<div>{category}</div>')
+
+    async def test_pushes_checkins_at_the_event(self):
+        user = await get_user_model().objects.aget(pk=self.user_ids[0])
+        matches = await sync_to_async(match_list)(user.pk, self.event.pk)
+        client = AsyncClient()
+        await client.aforce_login(user)
+
+        response = await client.get(reverse('event_detail_stream', args=['spring']))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await asyncio.wait_for(anext(stream), 5), b'retry: 5000\n\n')
+
+            # Arriving site-wide isn't arriving at this event
+            match_id = matches[0]['match_id']
+            HUB.publish(match_id, timezone.now() - timedelta(hours=1))
+            arrived_at = timezone.now()
+            HUB.publish(match_id, arrived_at, self.event.pk)
+
+            message = (await asyncio.wait_for(anext(stream), 5)).decode()
+            self.assertTrue(message.startswith('event: checkin\n'))
+            data = json.loads(message.split('data: ', 1)[1])
+            self.assertEqual(data, {'user_id': match_id, 'checked_in_at': arrived_at.isoformat()})
+        finally:
+            await stream.aclose()
+
+
+@mock.patch.object(CheckInHub, '_poll')  # Only local publishes here; the poller reads the table
+class CheckInHubTests(SimpleTestCase):
+    """publish must wake exactly the subscriptions watching that user at that event."""
+
+    async def test_routes_by_user_and_event(self, poll):
+        hub = CheckInHub()
+        at_event = hub.subscribe(1, [10, 11], event_id=5)
+        site_wide = hub.subscribe(2, [10])
+        arrived = timezone.now()
+
+        self.assertEqual(hub.publish(10, arrived, 5), 1)
+        self.assertEqual(hub.publish(12, arrived, 5), 0)
+        self.assertEqual(await at_event.get(), {'user_id': 10, 'checked_in_at': arrived.isoformat()})
+        self.assertTrue(site_wide.queue.empty())
+
+        self.assertEqual(hub.publish(10, arrived), 1)
+        self.assertEqual((await site_wide.get())['user_id'], 10)
+        self.assertTrue(at_event.queue.empty())
+
+        hub.unsubscribe(at_event)
+        self.assertEqual(hub.publish(11, arrived, 5), 0)
+        self.assertEqual(hub.publish(10, arrived), 1)
+        hub.unsubscribe(site_wide)
+        self.assertEqual(hub.publish(10, arrived), 0)
+
+
+@mock.patch.object(CheckInWriter, '_run')  # Flushed by hand instead of on the flusher thread
+class CheckInWriterTests(TransactionTestCase):
+    """Scans are sorted on submit, written in one go, and only rows that can't be written are lost."""
+
+    def setUp(self):
+        self.user_ids = synthetic.create_attendees(4, seed=6)
+        self.event = Event.objects.create(name="Spring", slug='spring')
+        self.event.attendees.set(self.user_ids[:2])
+        self.hub = mock.Mock()
+        self.writer = CheckInWriter(hub=self.hub)
+
+    def test_sorts_scans_and_writes_them_together(self, run):
+        missing = max(self.user_ids) + 1
+        first, second, outsider, _ = self.user_ids
+        self.assertEqual(self.writer.submit([first, first, missing], event=self.event), {
+            'accepted': [first], 'already_checked_in': [], 'unknown': [missing],
+        })
+        self.assertEqual(self.writer.submit([first, second, outsider], event=self.event), {
+            'accepted': [second], 'already_checked_in': [first], 'unknown': [outsider],
+        })
+        self.assertEqual(self.writer.submit([outsider])['accepted'], [outsider])
+
+        # One transaction: a read of existing rows per event, then a single insert
+        with self.assertNumQueries(5):
+            self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertCountEqual(
+            CheckIn.objects.values_list('event_id', 'user_id'),
+            [(self.event.pk, first), (self.event.pk, second), (None, outsider)],
+        )
+        published = [(args[0], args[2]) for args, _ in self.hub.publish.call_args_list]
+        self.assertCountEqual(published, [(first, self.event.pk), (second, self.event.pk), (outsider, None)])
+
+        self.assertEqual(self.writer.submit([first], event=self.event)['already_checked_in'], [first])
+        self.assertEqual(self.writer.submit([first])['accepted'], [first])
+
+    def test_drops_only_rows_that_cant_be_written(self, run):
+        gone, staying = self.user_ids[2:]
+        self.writer.submit([gone, staying])
+        get_user_model().objects.filter(pk=gone).delete()
+        with self.assertLogs('eventapp.checkins', 'WARNING'):
+            self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(list(CheckIn.objects.values_list('user_id', flat=True)), [staying])
+        self.assertEqual(self.writer.pending(), 0)
+
+    def test_keeps_the_batch_when_the_database_is_busy(self, run):
+        self.writer.submit(self.user_ids)
+        with mock.patch.object(self.writer, '_write', side_effect=OperationalError), \
+                self.assertRaises(OperationalError):
+            self.writer.flush()
+        self.assertEqual(self.writer.pending(), 4)
+        self.assertEqual(self.writer.flush(), 4)
+        self.assertEqual(CheckIn.objects.count(), 4)
+
+
+@override_settings(MATCH_DEBOUNCE_SECONDS=10, MATCH_MAX_DELAY_SECONDS=30)
+class SchedulerTests(TestCase):
+    """Submissions are debounced into one job per scope, claimed once, and retried a few times."""
+
+    def setUp(self):
+        self.user_ids = synthetic.create_attendees(3, seed=8)
+        self.event = Event.objects.create(name="Spring", slug='spring')
+        self.event.attendees.set(self.user_ids[:1])
+        self.start = timezone.now()
+
+    def at(self, seconds):
+        return mock.patch('django.utils.timezone.now', return_value=self.start + timedelta(seconds=seconds))
+
+    def test_debounces_one_job_per_scope(self):
+        attendee, other, _ = self.user_ids
+        with self.at(0):
+            scheduler.request_matching(attendee)
+        with self.at(25):
+            scheduler.request_matching(other)
+            scheduler.request_matching(attendee)
+
+        site_wide = MatchJob.objects.get(event=None)
+        self.assertEqual((site_wide.dirty_user_ids, site_wide.dirty_count), ([attendee, other], 2))
+        # Pushed back by each submission, but no further than the longest delay
+        self.assertEqual(site_wide.run_after, self.start + timedelta(seconds=30))
+        at_event = MatchJob.objects.get(event=self.event)
+        self.assertEqual((at_event.dirty_user_ids, at_event.dirty_count), ([attendee], 1))
+
+    def test_claims_due_jobs_once(self):
+        with self.at(0):
+            scheduler.request_matching(self.user_ids[1])
+        with self.at(5):
+            self.assertIsNone(scheduler.claim_next())
+        with self.at(10):
+            job = scheduler.claim_next()
+            self.assertIsNone(scheduler.claim_next())
+        self.assertEqual((job.state, job.dirty_user_ids), ('running', [self.user_ids[1]]))
+        self.assertEqual(MatchJob.objects.get().state, 'running')
+
+    def test_retries_failed_jobs_up_to_max_attempts(self):
+        user_id = self.user_ids[1]
+        with self.at(0):
+            scheduler.request_matching(user_id)
+        with mock.patch.object(scheduler, 'rematch', side_effect=RuntimeError), \
+                self.assertLogs('eventapp.scheduler', 'ERROR') as logs:
+            for attempt in range(1, scheduler.MAX_ATTEMPTS + 1):
+                with self.at(60 * attempt):
+                    job = scheduler.claim_next()
+                    self.assertEqual((job.attempt, job.dirty_user_ids), (attempt, [user_id]))
+                    self.assertEqual(scheduler.run_job(job).state, 'failed')
+
+        self.assertFalse(MatchJob.objects.filter(state='queued').exists())
+        self.assertEqual(MatchJob.objects.filter(state='failed').count(), scheduler.MAX_ATTEMPTS)
+        self.assertIn("Giving up", logs.output[-1])
+
+
+@override_settings(MATCH_IN_BACKGROUND=False)
+class QuizSubmissionTests(TestCase):
+    """A saved quiz must not turn into an error page when matching it in can't happen right away."""
+
+    def test_busy_database_queues_the_user(self):
+        user = get_user_model().objects.create_user('newcomer', password='pw')
+        self.client.force_login(user)
+        answers = {f'q{i}': '3' for i in range(len(PersonalityQuiz.QUESTIONS))}
+
+        locked = OperationalError('database is locked')
+        with mock.patch.object(match_store, 'update_user_everywhere', side_effect=locked), \
+                self.assertLogs('eventapp.scheduler', 'WARNING'):
+            response = self.client.post(reverse('personality_quiz'), answers)
+
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertTrue(PersonalityQuiz.objects.filter(user=user).exists())
+        job = MatchJob.objects.get(state='queued', event=None)
+        self.assertEqual(job.dirty_user_ids, [user.pk])
+
+
+class CacheTimeoutTests(SimpleTestCase):
+    """Entries in a per-process cache, which other processes can't invalidate, must only live seconds."""
+
+    def test_per_process_backend_caps_timeouts(self):
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(timeout_for(MATCHES_TIMEOUT), LOCAL_TIMEOUT)
+            self.assertEqual(timeout_for(1), 1)
+
+    def test_shared_backend_keeps_timeouts(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            self.assertEqual(timeout_for(MATCHES_TIMEOUT), MATCHES_TIMEOUT)
+
+
+class CategoryCacheTests(TestCase):
+    """Category lookups are cached until the quiz behind them changes."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_until_the_quiz_is_saved(self):
+        user_ids = synthetic.create_attendees(3, seed=10)
+        stranger = get_user_model().objects.create_user('stranger')
+        expected = dict(PersonalityQuiz.objects.values_list('user_id', 'category_classification'))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(categories_of(user_ids + [stranger.pk]), {**expected, stranger.pk: None})
+        with self.assertNumQueries(0):
+            self.assertEqual(category_of(user_ids[0]), expected[user_ids[0]])
+            self.assertIsNone(category_of(stranger.pk))
+
+        quiz = PersonalityQuiz.objects.get(user_id=user_ids[0])
+        for answers in ([1] * 9, [5] * 9, [1, 5, 1] * 3):
+            quiz.answers = answers
+            quiz.save()
+            if quiz.category_classification != expected[user_ids[0]]:
+                break
+        self.assertEqual(category_of(user_ids[0]), quiz.category_classification)
+        self.assertNotEqual(category_of(user_ids[0]), expected[user_ids[0]])
+
+
+class RunMatchingArgumentTests(TestCase):
+    """Bad sizes must be refused up front, before anything replaces the current matches."""
+
+    def test_rejects_bad_sizes(self):
+        for option, value in [
+            ('top_k', 0), ('top_k', -1), ('top_k', 40000), ('candidates', 0),
+            ('batch_size', 0), ('block_size', -5), ('memory_budget', 0),
+        ]:
+            with self.subTest(option=option, value=value), self.assertRaises(CommandError):
+                call_command('run_matching', stdout=StringIO(), **{option: value})
+        self.assertFalse(MatchGeneration.objects.exists())
+
+
+class MetricsEndpointTests(TestCase):
+    """/metrics must stay behind METRICS_TOKEN, which production can't run without."""
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_needs_the_token_when_set(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE matchsite_requests_total counter', response.content.decode())
+
+    def test_prod_profile_refuses_to_start_without_a_token(self):
+        environ = {name: value for name, value in os.environ.items() if name != 'METRICS_TOKEN'}
+        environ['SECRET_KEY'] = 'test'
+        self.addCleanup(sys.modules.pop, 'matchsite.settings.prod', None)
+        with mock.patch.dict(os.environ, environ, clear=True):
+            sys.modules.pop('matchsite.settings.prod', None)
+            with self.assertRaises(ImproperlyConfigured):
+                importlib.import_module('matchsite.settings.prod')
+
+            os.environ['METRICS_TOKEN'] = 's3cret'
+            sys.modules.pop('matchsite.settings.prod', None)
+            self.assertEqual(importlib.import_module('matchsite.settings.prod').METRICS_TOKEN, 's3cret')
+
+
+class MetricsMiddlewareTests(TestCase):
+    """Every request must be counted under its view, with the queries it ran."""
+
+    def test_counts_requests_and_queries(self):
+        served = metrics.REQUESTS.value('metrics', 'GET', '200')
+        with mock.patch.object(metrics.REQUEST_QUERIES, 'observe', wraps=metrics.REQUEST_QUERIES.observe) as observe:
+            self.client.get(reverse('metrics'))
+        self.assertEqual(metrics.REQUESTS.value('metrics', 'GET', '200'), served + 1)
+        (queries, view), _ = observe.call_args
+        self.assertEqual(view, 'metrics')
+        self.assertGreater(queries, 0)  # The job gauges read the job table
+
+    def test_unknown_paths_share_one_label(self):
+        missing = metrics.REQUESTS.value(metrics.UNMATCHED, 'GET', '404')
+        self.client.get('/no-such-page/')
+        self.client.get('/nor-this-one/')
+        self.assertEqual(metrics.REQUESTS.value(metrics.UNMATCHED, 'GET', '404'), missing + 2)
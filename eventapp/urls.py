@@ -10,4 +10,11 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('quiz/', views.personality_quiz_view, name='personality_quiz'),
     path('attraction-quiz/', views.attraction_quiz_view, name='attraction_quiz'),
+    path('event/', views.event_view, name='event'),
+    path('event/stream/', views.event_stream, name='event_stream'),
+    path('events/<slug:slug>/', views.event_view, name='event_detail'),
+    path('events/<slug:slug>/stream/', views.event_stream, name='event_detail_stream'),
+    path('api/checkins/', views.checkin_api, name='checkin_api'),
+    path('api/matching/status/', views.matching_status, name='matching_status'),
+    path('metrics', views.metrics_view, name='metrics'),  # Prometheus' default path, no slash
 ]
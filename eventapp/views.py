@@ -1,11 +1,32 @@
-from django.shortcuts import render, redirect
-from django.contrib.auth import login, logout
+import asyncio
+import hmac
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect
+from django.contrib.auth import get_user_model, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
+from django.views.decorators.http import require_POST
 
+from . import metrics, scheduler
+from .cache import cached_dashboard, categories_of, match_list
+from .checkins import HUB, WATCHED_MATCHES, WRITER
 from .forms import PersonalityQuizForm, AttractionQuizForm
-from .models import PersonalityQuiz, AttractionQuiz
+from .models import PersonalityQuiz, AttractionQuiz, CheckIn, Event
+
+# Comment line sent on idle event streams so proxies don't time them out
+KEEPALIVE_SECONDS = 15
+
+# Without ASGI the stream answers at once and the browser reconnects this often
+POLL_RETRY_MS = 5000
+
+# Most scans accepted in one check-in request
+MAX_SCANS_PER_REQUEST = 1000
 
 def home(request):
     return render(request, 'home.html')  # you already have this template
@@ -24,42 +45,40 @@ def signup_view(request):
     return render(request, 'signup.html', {'form': form})
 
 
-@login_required
-def dashboard(request):
-    user = request.user
-
-    # Has this user done the personality quiz?
-    has_quiz = PersonalityQuiz.objects.filter(user=user).exists()
-    
-    # Get the user's category classification
-    category = None
-    calculated_weights = None
-    try:
-        quiz = user.personality_quiz
-        category = quiz.category_classification
-        calculated_weights = quiz.calculated_weights
-    except PersonalityQuiz.DoesNotExist:
-        pass
-
-    # Has this user done the attraction quiz?
-    has_attraction_quiz = AttractionQuiz.objects.filter(user=user).exists()
-    
-    # Get the user's attraction preferences
-    attracted_category = None
-    try:
-        attraction_quiz = user.attraction_quiz
-        attracted_category = attraction_quiz.most_attracted_category
-    except AttractionQuiz.DoesNotExist:
-        pass
-
-    context = {
-        'has_quiz': has_quiz,
-        'category': category,
-        'calculated_weights': calculated_weights,
-        'has_attraction_quiz': has_attraction_quiz,
-        'attracted_category': attracted_category,
+async def current_user(request):
+    """
+    The logged-in user, loaded without blocking. request.user is pointed at
+    the same object so templates don't trigger a second, synchronous load.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+async def dashboard_context(user_id):
+    """Everything the dashboard shows, loaded with the user's quizzes in one query."""
+    user = await get_user_model().objects.select_related('personality_quiz', 'attraction_quiz').aget(pk=user_id)
+
+    # Has this user done the personality quiz? Get their category classification
+    quiz = getattr(user, 'personality_quiz', None)
+
+    # Has this user done the attraction quiz? Get their attraction preferences
+    attraction_quiz = getattr(user, 'attraction_quiz', None)
+
+    return {
+        'has_quiz': quiz is not None,
+        'category': quiz.category_classification if quiz else None,
+        'calculated_weights': quiz.calculated_weights if quiz else None,
+        'has_attraction_quiz': attraction_quiz is not None,
+        'attracted_category': attraction_quiz.most_attracted_category if attraction_quiz else None,
     }
 
+
+@login_required
+async def dashboard(request):
+    user = await current_user(request)
+    # Cached per user; saving either quiz drops the entry
+    context = await cached_dashboard(user.pk, dashboard_context)
     return render(request, 'dashboard.html', context)
 
 
@@ -69,14 +88,11 @@ def logout_view(request):
 
 
 @login_required
-def personality_quiz_view(request):
-    # Check if the user has already submitted the quiz
-    try:
-        existing_quiz = request.user.personality_quiz
-    except PersonalityQuiz.DoesNotExist:
-        existing_quiz = None
+async def personality_quiz_view(request):
+    user = await current_user(request)
 
-    if existing_quiz is not None:
+    # Check if the user has already submitted the quiz
+    if await PersonalityQuiz.objects.filter(user=user).aexists():
         # User already submitted; do not let them submit again
         messages.info(request, "You’ve already submitted the personality quiz. You can only do it once.")
         return redirect('dashboard')
@@ -88,8 +104,11 @@ def personality_quiz_view(request):
             answers = form.get_answers()
             
             # Create the PersonalityQuiz object with the answers
-            quiz = PersonalityQuiz(user=request.user, answers=answers)
-            quiz.save()  # This will auto-calculate weights and classify
+            quiz = PersonalityQuiz(user=user, answers=answers)
+            await quiz.asave()  # This will auto-calculate weights and classify
+
+            # Queue the new user for rematching, site-wide and at their events (see scheduler.py)
+            await sync_to_async(scheduler.refresh_matches)(user.pk)
             
             messages.success(request, "Your personality quiz has been saved!")
             return redirect('dashboard')
@@ -100,14 +119,11 @@ def personality_quiz_view(request):
 
 
 @login_required
-def attraction_quiz_view(request):
-    # Check if the user has already submitted the attraction quiz
-    try:
-        existing_quiz = request.user.attraction_quiz
-    except AttractionQuiz.DoesNotExist:
-        existing_quiz = None
+async def attraction_quiz_view(request):
+    user = await current_user(request)
 
-    if existing_quiz is not None:
+    # Check if the user has already submitted the attraction quiz
+    if await AttractionQuiz.objects.filter(user=user).aexists():
         # User already submitted; do not let them submit again
         messages.info(request, "You've already submitted the attraction quiz. You can only do it once.")
         return redirect('dashboard')
@@ -119,12 +135,141 @@ def attraction_quiz_view(request):
             answers = form.get_answers()
             
             # Create the AttractionQuiz object with the answers
-            quiz = AttractionQuiz(user=request.user, answers=answers)
-            quiz.save()  # This will auto-calculate preferences and find attracted category
+            quiz = AttractionQuiz(user=user, answers=answers)
+            await quiz.asave()  # This will auto-calculate preferences and find attracted category
+
+            # Queue the new user for rematching, site-wide and at their events (see scheduler.py)
+            await sync_to_async(scheduler.refresh_matches)(user.pk)
             
             messages.success(request, "Your attraction preferences have been saved!")
             return redirect('dashboard')
     else:
         form = AttractionQuizForm()
 
-    return render(request, 'attraction_quiz.html', {'form': form})
\ No newline at end of file
+    return render(request, 'attraction_quiz.html', {'form': form})
+
+
+async def attended_event(user, slug):
+    """The event at `slug` if `user` is one of its attendees (404 otherwise), or None without a slug."""
+    if slug is None:
+        return None
+    return await aget_object_or_404(Event, slug=slug, attendees=user)
+
+
+@login_required
+async def event_view(request, slug=None):
+    user = await current_user(request)
+    event = await attended_event(user, slug)
+    matches = (await sync_to_async(match_list)(user.pk, event.pk if event else None))[:WATCHED_MATCHES]
+    checked_in = {
+        user_id async for user_id in CheckIn.objects.filter(
+            event=event, user_id__in=[match['match_id'] for match in matches]
+        ).values_list('user_id', flat=True)
+    }
+    categories = await sync_to_async(categories_of)([match['match_id'] for match in matches])
+    match_statuses = [
+        {'match': match, 'category': categories[match['match_id']], 'is_checked_in': match['match_id'] in checked_in}
+        for match in matches
+    ]
+    return render(request, 'event.html', {'event': event, 'match_statuses': match_statuses})
+
+
+async def event_stream(request, slug=None):
+    """
+    Server-Sent Events for event.html: one 'checkin' event per match who
+    arrives. Under WSGI (runserver, sync gunicorn) a stream would never be
+    answered, so the response lists who has arrived so far and EventSource
+    polls by reconnecting every POLL_RETRY_MS.
+    """
+    user = await current_user(request)
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+
+    event = await attended_event(user, slug)
+    event_id = event.pk if event else None
+    matches = await sync_to_async(match_list)(user.pk, event_id)
+    watched = [match['match_id'] for match in matches[:WATCHED_MATCHES]]
+
+    if not isinstance(request, ASGIRequest):
+        arrived = CheckIn.objects.filter(event_id=event_id, user_id__in=watched).values_list('user_id', 'checked_in_at')
+        body = f'retry: {POLL_RETRY_MS}\n\n' + ''.join([
+            checkin_message({'user_id': user_id, 'checked_in_at': checked_in_at.isoformat()})
+            async for user_id, checked_in_at in arrived
+        ])
+        response = HttpResponse(body, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    async def events():
+        subscription = HUB.subscribe(user.pk, watched, event_id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    arrival = await asyncio.wait_for(subscription.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield checkin_message(arrival)
+        finally:
+            HUB.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let a proxy hold events back
+    return response
+
+
+def checkin_message(arrival):
+    return f'event: checkin\ndata: {json.dumps(arrival)}\n\n'
+
+
+@require_POST
+def checkin_api(request):
+    """
+    Door check-in for staff. Takes {"user_id": 5} or {"user_ids": [5, 6, ...]},
+    plus "event": "<slug>" for an event's door (only its attendees are known
+    there), and answers 202 as soon as the scans are queued; the rows are
+    written by the batching writer a few milliseconds later.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': "Staff only."}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+        user_ids = payload['user_ids'] if 'user_ids' in payload else [payload['user_id']]
+        slug = payload.get('event')
+        if not isinstance(user_ids, list) or not all(type(user_id) is int for user_id in user_ids):
+            raise ValueError
+        if slug is not None and not isinstance(slug, str):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {'error': "Send {\"user_id\": <id>} or {\"user_ids\": [<id>, ...]}, and optionally \"event\": <slug>."},
+            status=400,
+        )
+    if len(user_ids) > MAX_SCANS_PER_REQUEST:
+        return JsonResponse({'error': f"At most {MAX_SCANS_PER_REQUEST} scans per request."}, status=400)
+
+    event = None
+    if slug is not None:
+        event = Event.objects.filter(slug=slug).first()
+        if event is None:
+            return JsonResponse({'error': f"No event with slug {slug!r}."}, status=404)
+
+    return JsonResponse(WRITER.submit(user_ids, event), status=202)
+
+
+def matching_status(request):
+    """Background matching for staff: queue depth, job states and the latest runs."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': "Staff only."}, status=403)
+    return JsonResponse(scheduler.status())
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for this process's numbers (see metrics.py)."""
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse("Unauthorized.\n", status=401, content_type='text/plain')
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
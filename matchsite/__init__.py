@@ -0,0 +1,2 @@
+# Starts the startup timing clock before settings load
+from . import startup  # noqa: F401
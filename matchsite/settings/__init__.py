@@ -0,0 +1,25 @@
+"""
+Django settings for matchsite, split into profiles.
+
+DJANGO_SETTINGS_MODULE stays 'matchsite.settings'; MATCHSITE_PROFILE picks
+which profile is layered over base.py:
+
+    dev    (default) DEBUG on, the bundled SQLite database
+    prod   DEBUG off, SECRET_KEY from the environment, HTTPS only
+    bench  like prod over plain HTTP, for load tests and benchmark commands
+
+Environment variables (and .env, if present) are read once, in env.py.
+"""
+
+from .env import PROFILE
+
+if PROFILE == 'prod':
+    from .prod import *  # noqa: F401,F403
+elif PROFILE == 'bench':
+    from .bench import *  # noqa: F401,F403
+else:
+    from .dev import *  # noqa: F401,F403
+
+from matchsite import startup
+
+startup.mark('settings')
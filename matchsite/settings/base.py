@@ -0,0 +1,289 @@
+"""
+Settings shared by every profile (see matchsite/settings/__init__.py).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.2/ref/settings/
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+
+from . import env
+from .env import BASE_DIR
+
+# SECURITY WARNING: keep the secret key used in production secret!
+# The prod profile refuses to start without SECRET_KEY set.
+SECRET_KEY = env.get('SECRET_KEY', 'django-insecure-75ojryw1*$a*+pr6txp9jjd&3$*wfk4%cou8hhkq##jmeq9mti')
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = False
+
+# CSRF trusted origins for local and production
+CSRF_TRUSTED_ORIGINS = env.items('CSRF_TRUSTED_ORIGINS', [
+    'http://127.0.0.1:8000',
+    'http://localhost:8000',
+    'https://mess-website-production.up.railway.app',
+])
+
+ALLOWED_HOSTS = env.items('ALLOWED_HOSTS', ['*'])
+
+# Print where startup time went once the app registry is ready (see matchsite/startup.py)
+STARTUP_REPORT = env.flag('MATCHSITE_STARTUP_REPORT')
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'eventapp'
+]
+
+MIDDLEWARE = [
+    'eventapp.metrics.MetricsMiddleware',  # first, so it times everything below it
+    'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'matchsite.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'eventapp.metrics.InstrumentedTemplates',  # DjangoTemplates, timing renders
+        'DIRS': [],   # leave this as [] for now
+        'APP_DIRS': True,  # THIS must be True
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+
+WSGI_APPLICATION = 'matchsite.wsgi.application'
+ASGI_APPLICATION = 'matchsite.asgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+
+# DATABASE_URL picks the database; without it the bundled db.sqlite3 is used.
+#   DB_CONN_MAX_AGE         seconds a worker keeps its connection open
+#   DB_CONN_HEALTH_CHECKS   ping a reused connection before handing it out (default on)
+#   DB_POOL                 Postgres only: psycopg 3's built-in pool instead of one connection per thread
+#   DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE / DB_POOL_TIMEOUT   pool size per worker and wait limit
+#   DB_SQLITE_TUNING        SQLite only: WAL, relaxed fsync, big caches and IMMEDIATE transactions
+
+# Every new SQLite connection runs these PRAGMAs first when tuning is on:
+#   journal_mode=WAL     readers no longer block the writer (or each other)
+#   synchronous=NORMAL   fsync at checkpoints instead of every commit; safe with WAL
+#   mmap_size            read the database through a 256 MB memory map
+#   cache_size           64 MB page cache per connection (negative means KiB)
+#   temp_store=MEMORY    keep temporary tables and indexes off disk
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def database(conn_max_age=0, ssl_require=False, sqlite_tuning=False):
+    """The default database from the environment; arguments are the profile's defaults."""
+    conn_max_age = env.integer('DB_CONN_MAX_AGE', conn_max_age)
+    health_checks = env.flag('DB_CONN_HEALTH_CHECKS', True)
+    url = env.get('DATABASE_URL')
+
+    if not url:
+        config = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': health_checks,
+        }
+    else:
+        import dj_database_url
+        config = dj_database_url.parse(
+            url,
+            conn_max_age=conn_max_age,
+            conn_health_checks=health_checks,
+            # Only where there is a network connection to protect
+            ssl_require=ssl_require and not url.startswith('sqlite'),
+        )
+
+    if config['ENGINE'] == 'django.db.backends.sqlite3' and env.flag('DB_SQLITE_TUNING', sqlite_tuning):
+        config.setdefault('OPTIONS', {}).update({
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            # Take the write lock when a transaction starts. SQLite can't wait
+            # on a read lock that needs upgrading, which is where "database is
+            # locked" errors come from under concurrent submissions.
+            'transaction_mode': 'IMMEDIATE',
+            # Busy timeout: wait this many seconds for the write lock before giving up
+            'timeout': 20,
+        })
+
+    if env.flag('DB_POOL'):
+        if config['ENGINE'] != 'django.db.backends.postgresql':
+            raise ImproperlyConfigured("DB_POOL needs a Postgres DATABASE_URL.")
+        # Needs psycopg 3 with the pool extra (psycopg[pool]). The pool keeps
+        # connections itself; Django refuses persistent connections on top of it
+        config['CONN_MAX_AGE'] = 0
+        config.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': env.integer('DB_POOL_MIN_SIZE', 2),
+            'max_size': env.integer('DB_POOL_MAX_SIZE', 10),
+            'timeout': env.number('DB_POOL_TIMEOUT', 10),
+        }
+
+    return {'default': config}
+
+
+DATABASES = database()
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND picks where cached data lives:
+#   locmem - per process (the default; fine for runserver and a single worker;
+#            other processes can't invalidate its entries, so they only live seconds)
+#   file   - a directory shared by every worker on one machine (CACHE_LOCATION)
+#   redis  - any Redis-compatible server shared by every machine (CACHE_URL)
+
+CACHE_BACKEND = env.get('CACHE_BACKEND', 'locmem').lower()
+CACHE_TIMEOUT = env.integer('CACHE_TIMEOUT', 300)
+
+if CACHE_BACKEND == 'locmem':
+    default_cache = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'matchsite',
+    }
+elif CACHE_BACKEND == 'file':
+    default_cache = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env.get('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': env.integer('CACHE_MAX_ENTRIES', 20000)},
+    }
+elif CACHE_BACKEND == 'redis':
+    # Needs the redis package; a local redis-server (or Valkey, KeyDB, ...) works as a stand-in
+    default_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env.get('CACHE_URL', 'redis://127.0.0.1:6379/0'),
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}; use locmem, file or redis.")
+
+CACHES = {
+    'default': {
+        **default_cache,
+        'TIMEOUT': CACHE_TIMEOUT,
+        'KEY_PREFIX': env.get('CACHE_KEY_PREFIX', 'matchsite'),
+    }
+}
+
+# Sessions are read from the cache and written through to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Metrics and logging
+# /metrics serves request, query, template and cache numbers (see eventapp/metrics.py).
+# With METRICS_TOKEN set it needs an "Authorization: Bearer <token>" header;
+# the prod profile won't start without one.
+METRICS_TOKEN = env.get('METRICS_TOKEN')
+
+# LOG_LEVEL=DEBUG turns on per-submission quiz logging, of which only this
+# fraction is actually written
+QUIZ_LOG_SAMPLE_RATE = env.number('QUIZ_LOG_SAMPLE_RATE', 0.01)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'eventapp': {'handlers': ['console'], 'level': env.get('LOG_LEVEL', 'INFO').upper()},
+    },
+}
+
+
+# Background matching (see eventapp/scheduler.py)
+# Quiz submissions queue a debounced job for the match_worker process (the
+# Procfile's worker line) instead of patching matches during the request.
+# MATCH_IN_BACKGROUND=0 patches them inline, for setups without a worker.
+MATCH_IN_BACKGROUND = env.flag('MATCH_IN_BACKGROUND', True)
+
+# A job starts this long after the latest submission...
+MATCH_DEBOUNCE_SECONDS = env.number('MATCH_DEBOUNCE_SECONDS', 5)
+
+# ...but never later than this after the first one, so a steady stream can't hold it off
+MATCH_MAX_DELAY_SECONDS = env.number('MATCH_MAX_DELAY_SECONDS', 30)
+
+# Dirty users beyond which a job reruns matching in full rather than patching
+# users in one by one; used until earlier jobs' timings can decide instead
+MATCH_FULL_RUN_DIRTY = env.integer('MATCH_FULL_RUN_DIRTY', 50)
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.2/howto/static-files/
+STATIC_URL = '/static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+LOGIN_REDIRECT_URL = 'dashboard'   # where to go after login
+LOGOUT_REDIRECT_URL = 'home'       # where to go after logout
+LOGIN_URL = 'login'                # used by @login_required
+
+# Use WhiteNoise to serve static files in production
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
@@ -0,0 +1,16 @@
+"""
+Benchmarks and load tests: production-like (DEBUG off, persistent
+connections, tuned SQLite) but over plain HTTP, with cheap password hashing
+so seeding thousands of users doesn't dominate the run.
+"""
+
+from .base import *  # noqa: F401,F403
+from .base import database
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['*']
+
+DATABASES = database(conn_max_age=600, sqlite_tuning=True)
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -0,0 +1,15 @@
+"""Local development: DEBUG on and the bundled SQLite database."""
+
+from django.conf import global_settings
+
+from .base import *  # noqa: F401,F403
+from .base import env
+
+DEBUG = True
+
+# Attendees from seed_population get a cheap MD5 hash. Accepting it here lets
+# them log in; Django upgrades the hash to the first hasher on login.
+PASSWORD_HASHERS = [*global_settings.PASSWORD_HASHERS, 'django.contrib.auth.hashers.MD5PasswordHasher']
+
+# runserver alone has no match_worker, so patch matches inline unless asked not to
+MATCH_IN_BACKGROUND = env.flag('MATCH_IN_BACKGROUND', False)
@@ -0,0 +1,53 @@
+"""
+The environment, read once for every settings profile.
+
+A .env file next to manage.py is loaded first if there is one (real
+environment variables win), so python-dotenv is only imported when it has
+something to do.
+"""
+import os
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+ENV_FILE = BASE_DIR / '.env'
+if ENV_FILE.exists():
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE, override=False)
+
+PROFILES = ('dev', 'prod', 'bench')
+
+
+def get(name, default=None):
+    return os.environ.get(name, default)
+
+
+def flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def integer(name, default):
+    return int(os.environ.get(name, default))
+
+
+def number(name, default):
+    return float(os.environ.get(name, default))
+
+
+def items(name, default=()):
+    """A comma-separated variable as a list."""
+    value = os.environ.get(name)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+PROFILE = get('MATCHSITE_PROFILE', 'dev').strip().lower()
+if PROFILE not in PROFILES:
+    raise ImproperlyConfigured(f"Unknown MATCHSITE_PROFILE {PROFILE!r}; use one of {', '.join(PROFILES)}.")
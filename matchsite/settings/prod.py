@@ -0,0 +1,37 @@
+"""Production: DEBUG off, secrets from the environment, HTTPS only."""
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+from .base import database, env
+
+DEBUG = False
+
+SECRET_KEY = env.get('SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured("Set SECRET_KEY to run with MATCHSITE_PROFILE=prod.")
+
+# /metrics names every view and its traffic, so it's never public in production
+METRICS_TOKEN = env.get('METRICS_TOKEN')
+if not METRICS_TOKEN:
+    raise ImproperlyConfigured("Set METRICS_TOKEN to run with MATCHSITE_PROFILE=prod.")
+
+ALLOWED_HOSTS = env.items('ALLOWED_HOSTS', ['mess-website-production.up.railway.app'])
+
+CSRF_TRUSTED_ORIGINS = env.items('CSRF_TRUSTED_ORIGINS', [
+    'https://mess-website-production.up.railway.app',
+])
+
+# Keep connections for ten minutes; the bundled SQLite file gets the tuned profile
+DATABASES = database(conn_max_age=600, ssl_require=True, sqlite_tuning=True)
+
+# The platform's proxy terminates TLS and says so in X-Forwarded-Proto
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+SECURE_SSL_REDIRECT = True
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True
+CSRF_COOKIE_HTTPONLY = False
+
+SECURE_HSTS_SECONDS = 31536000
+SECURE_HSTS_INCLUDE_SUBDOMAINS = True
+SECURE_HSTS_PRELOAD = True
@@ -0,0 +1,31 @@
+"""
+Startup timing report.
+
+The clock starts when the matchsite package is first imported (settings are
+always its first import). Settings and the app registry mark their
+milestones here, and with MATCHSITE_STARTUP_REPORT=1 the report is written
+to stderr as soon as the app registry is ready, for management commands and
+web workers alike.
+"""
+import sys
+import time
+
+STARTED_AT = time.perf_counter()
+
+_marks = []
+
+
+def mark(label):
+    """Record that `label` finished now."""
+    _marks.append((label, time.perf_counter()))
+
+
+def report(stream=None):
+    """Write each milestone's own time and the running total in milliseconds."""
+    stream = stream or sys.stderr
+    previous = STARTED_AT
+    lines = []
+    for label, at in _marks:
+        lines.append(f"  {label:<12} {(at - previous) * 1000:7.1f} ms  (total {(at - STARTED_AT) * 1000:7.1f} ms)")
+        previous = at
+    stream.write("Startup timing:\n" + "\n".join(lines) + "\n")